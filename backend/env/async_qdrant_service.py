@@ -0,0 +1,220 @@
+import os
+import asyncio
+import logging
+from typing import Optional, List, Tuple, Dict, Any
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http import models
+from qdrant_service import (
+    QdrantService,
+    normalize_iocs,
+    _NEWEST_FIRST,
+    _model_filter,
+    _session_first_requests,
+    _pick_session_first,
+    _pending_write,
+    _build_points,
+    _format_search_context,
+    _ioc_filter,
+    _session_tenant_filter,
+    _untagged_session_filter,
+    _format_ioc_context,
+    _stats_summary,
+    _conversation_dict,
+    _last_turn,
+)
+
+logger = logging.getLogger(__name__)
+
+class AsyncQdrantService:
+    """Async variant of QdrantService backed by AsyncQdrantClient over gRPC.
+
+    Reuses the sync service for collection setup, the embedding cache/batcher and the
+    write-behind queue; every read (and the direct upsert when write-behind is off) is
+    awaited on the event loop instead of being offloaded to a thread. The client must be
+    created inside the running loop, since gRPC aio channels bind to it.
+    """
+
+    def __init__(self, store: QdrantService):
+        self.store = store
+        self.collection_name = store.collection_name
+        self.client = AsyncQdrantClient(
+            url=store.qdrant_url,
+            prefer_grpc=True,
+            grpc_port=int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+            timeout=30
+        )
+        logger.info("✅ Async Qdrant gRPC client created")
+
+    async def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        """Cache-then-batcher like QdrantService._embed, without touching SQLite on the event loop.
+
+        Only the memory tier is read here; new vectors reach the disk tier through the
+        cache's background writer.
+        """
+        vectors = self.store.embedding_cache.get_many(texts, use_disk=False)
+        pending = list(dict.fromkeys(t for i, t in enumerate(texts) if i not in vectors))
+        if pending:
+            encoded = await asyncio.wrap_future(self.store.embedding_batcher.submit(pending))
+            self.store.embedding_cache.put_many(pending, encoded, background=True)
+            by_text = dict(zip(pending, encoded))
+            for i, text in enumerate(texts):
+                if i not in vectors:
+                    vectors[i] = by_text[text]
+        return [vectors[i] for i in range(len(texts))]
+
+    async def store_conversation(self, conversation_id: str, session_id: str, user_message: str, chatbot_response: str, model: str, metadata: Dict[str, Any] = None, iocs: Optional[List[str]] = None, tenant: Optional[str] = None):
+        if self.store.write_behind:
+            # Encolar no bloquea; el hilo de write-behind hace el upsert
+            self.store.store_conversation(conversation_id, session_id, user_message, chatbot_response, model, metadata, iocs, tenant)
+            return
+        pending = _pending_write(conversation_id, session_id, user_message, chatbot_response, model, metadata, iocs, tenant)
+        points = _build_points([pending], await self._embed([pending["text"]]))
+        for attempt in range(3):
+            try:
+                await self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+                logger.info(f"✅ Stored conversation {conversation_id} in Qdrant (async)")
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Retry {attempt + 1}/3: Failed to store conversation {conversation_id}: {e}")
+                if attempt == 2:
+                    logger.error(f"❌ Failed to store conversation in Qdrant: {type(e).__name__} - {str(e)}")
+                    raise
+
+    async def _query_session_first(self, model: str, session_id: Optional[str], query: Any, limit: int, params: Optional[models.SearchParams] = None, tenant: Optional[str] = None, strict_tenant: bool = False) -> List[Any]:
+        responses = await self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=_session_first_requests(model, session_id, query, limit, params, tenant, strict_tenant)
+        )
+        return _pick_session_first(responses, model, session_id)
+
+    async def search_conversations(self, query: str, model: str, session_id: str, limit: int = 15, similarity_threshold: float = 0.3, include_all_sessions: bool = False, tenant: Optional[str] = None, strict_tenant: bool = False) -> str:
+        try:
+            query_embedding = (await self._embed([query.strip().lower()]))[0]
+            points = await self._query_session_first(
+                model,
+                None if include_all_sessions else session_id,
+                query_embedding.tolist(),
+                limit,
+                self.store.search_params,
+                tenant,
+                strict_tenant
+            )
+            return _format_search_context(points, session_id)
+        except Exception as e:
+            logger.error(f"❌ Error searching in Qdrant: {type(e).__name__} - {str(e)}")
+            return "Error al buscar conversaciones en la base de datos."
+
+    async def search_ioc_mentions(self, iocs: List[str], max_tokens: int = 2000, limit: int = 20, tenant: Optional[str] = None) -> str:
+        iocs = normalize_iocs(iocs)
+        if not iocs:
+            return ""
+        try:
+            points, _ = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=_ioc_filter(iocs, tenant),
+                limit=limit,
+                with_payload=True,
+                with_vectors=False,
+                order_by=_NEWEST_FIRST
+            )
+            return _format_ioc_context(points, iocs, max_tokens)
+        except Exception as e:
+            logger.error(f"❌ Error in IoC lookup: {type(e).__name__} - {str(e)}")
+            return ""
+
+    async def get_session_tenant(self, session_id: str) -> Optional[str]:
+        try:
+            points, _ = await self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=_session_tenant_filter(session_id),
+                limit=1,
+                with_payload=["tenant"],
+                with_vectors=False,
+                order_by=_NEWEST_FIRST
+            )
+            return points[0].payload.get("tenant") if points else None
+        except Exception as e:
+            logger.error(f"❌ Error resolving session tenant: {type(e).__name__} - {str(e)}")
+            return None
+
+    async def assign_session_tenant(self, session_id: str, tenant: str):
+        try:
+            await self.client.set_payload(
+                collection_name=self.collection_name,
+                payload={"tenant": tenant},
+                points=_untagged_session_filter(session_id),
+                wait=False
+            )
+            logger.info(f"🏷️ Session {session_id[:8]} assigned to tenant {tenant}")
+        except Exception as e:
+            logger.error(f"❌ Error assigning session tenant: {type(e).__name__} - {str(e)}")
+
+    async def get_conversation_data(self, model: str, session_id: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        try:
+            points, stats = await asyncio.gather(
+                self._query_session_first(model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), limit),
+                self.get_conversation_stats(model)
+            )
+            conversations = [_conversation_dict(point) for point in points]
+            logger.info(f"✅ Retrieved {len(conversations)} conversations with stats")
+            return {
+                "conversations": conversations,
+                "stats": stats,
+                "total_conversations": len(conversations)
+            }
+        except Exception as e:
+            logger.error(f"❌ Error retrieving conversation data: {type(e).__name__} - {str(e)}")
+            return {"conversations": [], "stats": {}, "total_conversations": 0}
+
+    async def get_last_conversation(self, model: str, session_id: Optional[str] = None, tenant: Optional[str] = None) -> Tuple[str, str]:
+        try:
+            points = await self._query_session_first(
+                model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), 1,
+                tenant=tenant, strict_tenant=tenant is not None
+            )
+            return _last_turn(points, model)
+        except Exception as e:
+            logger.error(f"❌ Error retrieving last conversation: {type(e).__name__} - {str(e)}")
+            return "", ""
+
+    async def get_conversation_history(self, model: str, session_id: Optional[str] = None, limit: int = 10, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        try:
+            points = await self._query_session_first(
+                model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), limit,
+                tenant=tenant, strict_tenant=tenant is not None
+            )
+            history = [_conversation_dict(point) for point in points]
+            logger.info(f"✅ Retrieved {len(history)} conversations for history (model: {model})")
+            return history
+        except Exception as e:
+            logger.error(f"❌ Error retrieving conversation history: {type(e).__name__} - {str(e)}")
+            return []
+
+    async def _facet_counts(self, key: str, facet_filter: Optional[models.Filter] = None) -> Dict[str, int]:
+        response = await self.client.facet(
+            collection_name=self.collection_name,
+            key=key,
+            facet_filter=facet_filter,
+            limit=self.store.stats_facet_limit,
+            exact=True
+        )
+        return {str(hit.value): hit.count for hit in response.hits}
+
+    async def get_conversation_stats(self, model: str = "openai") -> Dict[str, Any]:
+        try:
+            model_filter = _model_filter(model)
+            # Las cuatro consultas van en paralelo por el mismo canal gRPC
+            total, sessions, per_model, per_day = await asyncio.gather(
+                self.client.count(collection_name=self.collection_name, count_filter=model_filter, exact=True),
+                self._facet_counts("session_id", model_filter),
+                self._facet_counts("model"),
+                self._facet_counts("day", model_filter)
+            )
+            return _stats_summary(total.count, sessions, per_model, per_day, self.store.stats_facet_limit)
+        except Exception as e:
+            logger.error(f"❌ Error getting stats: {e}")
+            return {"total_conversations": 0}
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,225 @@
+"""Perfil declarativo de la colección mateo_conversations (HNSW, cuantización, disco, segmentos).
+
+QDRANT_COLLECTION_PROFILE selecciona un perfil incluido ("default", "large") o la ruta a un
+JSON con las mismas claves; las que falten toman el valor de "default". El perfil se usa al
+crear la colección y en los parámetros de búsqueda. Para cambiar una colección existente:
+
+    python collection_profile.py migrate --profile large --samples 100
+    python collection_profile.py benchmark
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Dict, List, Optional
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+logger = logging.getLogger(__name__)
+
+VECTOR_SIZE = 384
+
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # Configuración histórica: sin índice HNSW (indexing_threshold=0), búsqueda exhaustiva por segmento
+    "default": {
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "hnsw_ef": None,
+        "hnsw_on_disk": False,
+        "vectors_on_disk": True,
+        # Valor por defecto del servidor, que es con el que se creó la colección originalmente
+        "payload_on_disk": True,
+        "indexing_threshold": 0,
+        "memmap_threshold": 20000,
+        "default_segment_number": 0,
+        "quantization": None,
+        "quantization_always_ram": True,
+        "quantization_quantile": 0.99,
+        "rescore": True,
+        "oversampling": 2.0,
+    },
+    # Millones de turnos: HNSW activo, vectores int8 en RAM con rescoring sobre los originales en disco
+    "large": {
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 128,
+        "hnsw_ef": 128,
+        "hnsw_on_disk": False,
+        "vectors_on_disk": True,
+        "payload_on_disk": True,
+        "indexing_threshold": 20000,
+        "memmap_threshold": 20000,
+        "default_segment_number": 2,
+        "quantization": "int8",
+        "quantization_always_ram": True,
+        "quantization_quantile": 0.99,
+        "rescore": True,
+        "oversampling": 2.0,
+    },
+}
+
+def load_profile(name_or_path: Optional[str] = None) -> Dict[str, Any]:
+    name_or_path = name_or_path or os.getenv("QDRANT_COLLECTION_PROFILE", "default")
+    if name_or_path in PROFILES:
+        overrides = PROFILES[name_or_path]
+    else:
+        with open(name_or_path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(PROFILES["default"])
+        if unknown:
+            raise ValueError(f"Unknown collection profile keys: {sorted(unknown)}")
+    return {**PROFILES["default"], **overrides}
+
+def _quantization_config(profile: Dict[str, Any]) -> Optional[models.ScalarQuantization]:
+    if profile["quantization"] is None:
+        return None
+    if profile["quantization"] != "int8":
+        raise ValueError(f"Unsupported quantization {profile['quantization']}; only int8 scalar is supported")
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=profile["quantization_quantile"],
+            always_ram=profile["quantization_always_ram"]
+        )
+    )
+
+def _hnsw_config(profile: Dict[str, Any]) -> models.HnswConfigDiff:
+    return models.HnswConfigDiff(
+        m=profile["hnsw_m"],
+        ef_construct=profile["hnsw_ef_construct"],
+        on_disk=profile["hnsw_on_disk"]
+    )
+
+def _optimizers_config(profile: Dict[str, Any]) -> models.OptimizersConfigDiff:
+    return models.OptimizersConfigDiff(
+        indexing_threshold=profile["indexing_threshold"],
+        memmap_threshold=profile["memmap_threshold"],
+        default_segment_number=profile["default_segment_number"]
+    )
+
+def create_collection_kwargs(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Arguments for QdrantClient.create_collection, besides collection_name."""
+    return {
+        "vectors_config": models.VectorParams(
+            size=VECTOR_SIZE,
+            distance=models.Distance.COSINE,
+            on_disk=profile["vectors_on_disk"]
+        ),
+        "hnsw_config": _hnsw_config(profile),
+        "optimizers_config": _optimizers_config(profile),
+        "quantization_config": _quantization_config(profile),
+        "on_disk_payload": profile["payload_on_disk"],
+    }
+
+def search_params(profile: Dict[str, Any]) -> Optional[models.SearchParams]:
+    """Query-time parameters for vector searches (None keeps the server defaults)."""
+    quantization = None
+    if profile["quantization"] is not None:
+        quantization = models.QuantizationSearchParams(
+            rescore=profile["rescore"],
+            oversampling=profile["oversampling"]
+        )
+    if profile["hnsw_ef"] is None and quantization is None:
+        return None
+    return models.SearchParams(hnsw_ef=profile["hnsw_ef"], quantization=quantization)
+
+def apply_profile(client: QdrantClient, collection_name: str, profile: Dict[str, Any]) -> None:
+    """Update an existing collection in place; Qdrant rebuilds indexes in the background."""
+    quantization = _quantization_config(profile) or models.Disabled.DISABLED
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=profile["vectors_on_disk"])},
+        hnsw_config=_hnsw_config(profile),
+        optimizers_config=_optimizers_config(profile),
+        quantization_config=quantization,
+        collection_params=models.CollectionParamsDiff(on_disk_payload=profile["payload_on_disk"])
+    )
+    logger.info(f"✅ Profile applied to {collection_name}")
+
+def wait_until_optimized(client: QdrantClient, collection_name: str, timeout: float = 1800.0, poll: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get_collection(collection_name=collection_name).status
+        if status == models.CollectionStatus.GREEN:
+            return True
+        logger.info(f"⏳ {collection_name} optimizing (status={status})")
+        time.sleep(poll)
+    return False
+
+# ----------------- BENCHMARK -------------------
+
+def sample_query_vectors(client: QdrantClient, collection_name: str, samples: int) -> List[List[float]]:
+    """Stored vectors as the query set: representative of real traffic and no embedding model needed."""
+    points, _ = client.scroll(
+        collection_name=collection_name,
+        limit=samples,
+        with_payload=False,
+        with_vectors=True
+    )
+    return [p.vector for p in points]
+
+def benchmark(client: QdrantClient, collection_name: str, queries: List[List[float]], params: Optional[models.SearchParams], k: int = 15) -> Dict[str, float]:
+    """Latency of the profile's search versus recall@k against exact (brute force) search."""
+    latencies = []
+    recalls = []
+    for vector in queries:
+        started = time.perf_counter()
+        approx = client.query_points(collection_name=collection_name, query=vector, limit=k, search_params=params, with_payload=False).points
+        latencies.append((time.perf_counter() - started) * 1000)
+        exact = client.query_points(
+            collection_name=collection_name,
+            query=vector,
+            limit=k,
+            search_params=models.SearchParams(exact=True),
+            with_payload=False
+        ).points
+        expected = {p.id for p in exact}
+        if expected:
+            recalls.append(len(expected & {p.id for p in approx}) / len(expected))
+    latencies.sort()
+    if not latencies:
+        return {"queries": 0}
+    return {
+        "queries": len(latencies),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        f"recall@{k}": round(sum(recalls) / len(recalls), 4) if recalls else 0.0,
+    }
+
+if __name__ == "__main__":
+    from pathlib import Path
+    from dotenv import load_dotenv
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    load_dotenv(Path(__file__).resolve().parent / ".env")
+
+    parser = argparse.ArgumentParser(description="Qdrant collection profile tools")
+    parser.add_argument("command", choices=["benchmark", "migrate"])
+    parser.add_argument("--profile", default=None, help="Built-in profile name or JSON path (default: QDRANT_COLLECTION_PROFILE)")
+    parser.add_argument("--collection", default="mateo_conversations")
+    parser.add_argument("--samples", type=int, default=100)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="Seconds to wait for re-indexing after migrate")
+    args = parser.parse_args()
+
+    client = QdrantClient(url=os.getenv("QDRANT_URL"), prefer_grpc=False, timeout=60)
+    profile = load_profile(args.profile)
+    queries = sample_query_vectors(client, args.collection, args.samples)
+    if not queries:
+        logger.error(f"❌ {args.collection} has no points to sample queries from")
+        sys.exit(1)
+
+    if args.command == "benchmark":
+        logger.info(f"📊 {json.dumps(benchmark(client, args.collection, queries, search_params(profile), args.k))}")
+        sys.exit(0)
+
+    # migrate: la medición "antes" usa los parámetros de búsqueda con los que corre hoy el servicio
+    before = benchmark(client, args.collection, queries, search_params(load_profile()), args.k)
+    logger.info(f"📊 Before: {json.dumps(before)}")
+    apply_profile(client, args.collection, profile)
+    if not wait_until_optimized(client, args.collection, timeout=args.timeout):
+        logger.warning(f"⚠️ {args.collection} still optimizing after {args.timeout}s; measuring anyway")
+    after = benchmark(client, args.collection, queries, search_params(profile), args.k)
+    logger.info(f"📊 After:  {json.dumps(after)}")
+    print(json.dumps({"profile": profile, "before": before, "after": after}, indent=2))
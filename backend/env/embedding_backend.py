@@ -0,0 +1,73 @@
+import os
+import sys
+import logging
+import argparse
+from typing import List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+DEFAULT_ONNX_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+
+# Frases representativas del tráfico real para la verificación de equivalencia
+SAMPLE_TEXTS = [
+    "¿Cuál fue la última consulta?",
+    "Alertas críticas de TrendMicro para COS_L en los últimos 7 días",
+    "Investiga la IP 185.220.101.45 y el hash 44d88612fea8a8f36de82e1278abb02f",
+    "Resumen de anomalías de Exabeam para el usuario jperez@suma.com",
+    "Tickets abiertos en Jira del proyecto INCIDENT con prioridad alta",
+    "Mapea la cadena de ataque a MITRE ATT&CK y sugiere mitigaciones",
+]
+
+def embedding_backend() -> str:
+    return os.getenv("EMBEDDING_BACKEND", "torch").lower()
+
+def load_embedding_model(backend: str = None):
+    """Load all-MiniLM-L6-v2 with the torch backend or as an int8-quantized ONNX model on CPU."""
+    # Importación diferida: sentence-transformers arrastra torch y tarda segundos en cargar
+    from sentence_transformers import SentenceTransformer
+    backend = backend or embedding_backend()
+    if backend == "onnx":
+        onnx_path = os.getenv("EMBEDDING_ONNX_PATH", MODEL_NAME)
+        onnx_file = os.getenv("EMBEDDING_ONNX_FILE", DEFAULT_ONNX_FILE)
+        return SentenceTransformer(
+            onnx_path,
+            backend="onnx",
+            device="cpu",
+            model_kwargs={"file_name": onnx_file, "provider": "CPUExecutionProvider"}
+        )
+    return SentenceTransformer(MODEL_NAME)
+
+def export_quantized(output_dir: str, config: str = "avx512_vnni") -> None:
+    """Export the model to ONNX and write a dynamically int8-quantized copy next to it."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    model = SentenceTransformer(MODEL_NAME, backend="onnx")
+    model.save(output_dir)
+    export_dynamic_quantized_onnx_model(model, config, output_dir)
+    logger.info(f"✅ Quantized ONNX model ({config}) exported to {output_dir}")
+
+def check_equivalence(texts: List[str] = None, min_cosine: float = 0.99) -> bool:
+    """Compare ONNX and PyTorch vectors; they must stay interchangeable in mateo_conversations."""
+    texts = texts or SAMPLE_TEXTS
+    reference = load_embedding_model("torch").encode(texts, normalize_embeddings=True)
+    candidate = load_embedding_model("onnx").encode(texts, normalize_embeddings=True)
+    cosines = np.sum(reference * candidate, axis=1)
+    logger.info(f"📊 Cosine torch vs onnx: min={cosines.min():.4f} mean={cosines.mean():.4f}")
+    return bool(cosines.min() >= min_cosine)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="ONNX embedding backend tools")
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--output-dir", default="models/all-MiniLM-L6-v2-onnx")
+    parser.add_argument("--quantization", default="avx512_vnni", choices=["arm64", "avx2", "avx512", "avx512_vnni"])
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_quantized(args.output_dir, args.quantization)
+    else:
+        ok = check_equivalence(min_cosine=args.min_cosine)
+        logger.info("✅ ONNX backend is equivalent" if ok else "❌ ONNX backend diverges from PyTorch")
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,84 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """Micro-batcher that merges concurrent encode calls into a single model batch.
+
+    Callers block on a Future while a worker thread waits up to max_wait_ms for more
+    requests (or until max_batch texts are pending) and then encodes them together.
+    """
+
+    def __init__(self, encode_fn: Callable[..., List[np.ndarray]], max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._requests: "queue.Queue[tuple]" = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def from_env(cls, encode_fn: Callable[..., List[np.ndarray]]) -> "EmbeddingBatcher":
+        return cls(
+            encode_fn=encode_fn,
+            max_batch=int(os.getenv("EMBEDDING_MAX_BATCH", "64")),
+            max_wait_ms=float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+        )
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue texts and return the Future; async callers can await it via asyncio.wrap_future."""
+        future: Future = Future()
+        self._requests.put((texts, future))
+        return future
+
+    def encode(self, texts: List[str]) -> List[np.ndarray]:
+        return self.submit(texts).result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._encode_batch(batch, size)
+
+    def _encode_batch(self, batch: List[tuple], size: int):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        try:
+            vectors = self.encode_fn(texts, batch_size=max(size, 1))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += size
+        offset = 0
+        for request_texts, future in batch:
+            future.set_result(list(vectors[offset:offset + len(request_texts)]))
+            offset += len(request_texts)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "pending": self._requests.qsize(),
+        }
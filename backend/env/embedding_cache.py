@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """LRU cache of embeddings keyed by a content hash, with an optional SQLite disk tier.
+
+    The memory tier is bounded in bytes. The disk tier is a single SQLite file, so
+    several uvicorn processes on the same host can share the vectors they computed.
+    """
+
+    def __init__(self, model_name: str, max_bytes: int = 64 * 1024 * 1024, disk_path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_writer: Optional[ThreadPoolExecutor] = None
+        if disk_path:
+            conn = self._disk()
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            conn.commit()
+
+    @classmethod
+    def from_env(cls, model_name: str) -> "EmbeddingCache":
+        return cls(
+            model_name=model_name,
+            max_bytes=int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 1024 * 1024),
+            disk_path=os.getenv("EMBEDDING_CACHE_PATH") or None
+        )
+
+    def _disk(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets the two API processes read while one writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.disk_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def get_many(self, texts: List[str], use_disk: bool = True) -> Dict[int, np.ndarray]:
+        """Return cached vectors by position in texts; missing positions are omitted.
+
+        use_disk=False only consults the memory tier (safe to call from the event loop).
+        """
+        found, missing = {}, {}
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self.key(text)
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[i] = vector
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+        if missing and self.disk_path and use_disk:
+            try:
+                keys = list(missing)
+                placeholders = ",".join("?" * len(keys))
+                rows = self._disk().execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for i in missing.pop(key):
+                        found[i] = vector
+                        self.disk_hits += 1
+            except sqlite3.Error as e:
+                logger.warning(f"⚠️ Embedding disk cache read failed: {e}")
+        self.misses += sum(len(v) for v in missing.values())
+        return found
+
+    def put_many(self, texts: List[str], vectors: List[np.ndarray], background: bool = False):
+        """Store vectors in both tiers; with background=True the SQLite write runs on a writer thread."""
+        rows = []
+        for text, vector in zip(texts, vectors):
+            key = self.key(text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self._remember(key, vector)
+            rows.append((key, vector.tobytes()))
+        if not rows or not self.disk_path:
+            return
+        if background:
+            with self._lock:
+                if self._disk_writer is None:
+                    self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-cache-writer")
+            self._disk_writer.submit(self._write_disk, rows)
+        else:
+            self._write_disk(rows)
+
+    def _write_disk(self, rows: List[tuple]):
+        try:
+            conn = self._disk()
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Embedding disk cache write failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,177 @@
+"""Proceso de inferencia compartido: embeddings y NER para todos los workers de la API.
+
+El servidor carga una sola copia del SentenceTransformer y del pipeline de spaCy y
+atiende a los procesos uvicorn por un socket Unix (multiprocessing.connection).
+Las peticiones de embedding de todos los workers pasan por un único EmbeddingBatcher.
+
+    INFERENCE_SOCKET=/tmp/mateo-inference.sock INFERENCE_AUTHKEY=<secreto> python inference_server.py
+
+multiprocessing.connection deserializa (pickle) lo que recibe, así que servidor y workers
+deben compartir INFERENCE_AUTHKEY (no hay valor por defecto) y el socket se crea con modo 0600.
+"""
+import os
+import time
+import logging
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import Any, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/mateo-inference.sock"
+
+def _authkey() -> bytes:
+    authkey = os.getenv("INFERENCE_AUTHKEY")
+    if not authkey:
+        raise RuntimeError("INFERENCE_AUTHKEY is required when INFERENCE_SOCKET is set")
+    return authkey.encode("utf-8")
+
+# ----------------- SERVIDOR -------------------
+
+def _handle_connection(conn, batcher, nlp, nlp_lock):
+    with conn:
+        while True:
+            try:
+                op, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if op == "encode":
+                    result = [np.asarray(v, dtype=np.float32) for v in batcher.encode(payload)]
+                elif op == "ner":
+                    if nlp is None:
+                        result = None
+                    else:
+                        with nlp_lock:
+                            doc = nlp(payload)
+                        result = [(ent.text, ent.label_) for ent in doc.ents]
+                elif op == "ping":
+                    result = {"embedding": True, "ner": nlp is not None}
+                else:
+                    raise ValueError(f"Unknown op {op}")
+                conn.send(("ok", result))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+
+def serve(address: str = None):
+    from embedding_backend import load_embedding_model
+    from embedding_batcher import EmbeddingBatcher
+
+    address = address or os.getenv("INFERENCE_SOCKET", DEFAULT_SOCKET)
+    authkey = _authkey()
+    model = load_embedding_model()
+    model.encode(["warmup"])
+    batcher = EmbeddingBatcher.from_env(lambda texts, batch_size: model.encode(texts, batch_size=batch_size))
+    logger.info("✅ Embedding model loaded in inference server")
+
+    try:
+        import spacy
+        nlp = spacy.load("es_core_news_sm")
+        logger.info("✅ spaCy loaded in inference server")
+    except Exception as e:
+        nlp = None
+        logger.warning(f"⚠️ spaCy no cargado para NER: {e}")
+    nlp_lock = threading.Lock()
+
+    if os.path.exists(address):
+        os.remove(address)
+    # umask restrictiva para que el socket nunca exista con permisos abiertos, y chmod por si acaso
+    previous_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(previous_umask)
+    os.chmod(address, 0o600)
+    with listener:
+        logger.info(f"🧠 Inference server listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning(f"⚠️ Rejected inference connection: {e}")
+                continue
+            threading.Thread(target=_handle_connection, args=(conn, batcher, nlp, nlp_lock), daemon=True).start()
+
+# ----------------- CLIENTE -------------------
+
+class InferenceClient:
+    """Cliente con una conexión por hilo hacia el servidor de inferencia."""
+
+    def __init__(self, address: str, connect_timeout: float = 60.0):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls) -> Optional["InferenceClient"]:
+        address = os.getenv("INFERENCE_SOCKET")
+        if not address:
+            return None
+        _authkey()  # Falla al arrancar el worker, no en la primera petición
+        return cls(address, float(os.getenv("INFERENCE_CONNECT_TIMEOUT", "60")))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        # El servidor puede estar arrancando a la vez que los workers
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                conn = Client(self.address, family="AF_UNIX", authkey=_authkey())
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._local.conn = conn
+        return conn
+
+    def call(self, op: str, payload: Any = None) -> Any:
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send((op, payload))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt == 1:
+                    raise
+        if status == "error":
+            raise RuntimeError(f"Inference server error: {result}")
+        return result
+
+class RemoteEmbeddingModel:
+    """Expone encode() como SentenceTransformer pero delega en el servidor de inferencia."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def encode(self, texts: List[str], batch_size: int = None, **kwargs) -> np.ndarray:
+        return np.stack(self.client.call("encode", list(texts)))
+
+class RemoteEntity:
+    def __init__(self, text: str, label: str):
+        self.text = text
+        self.label_ = label
+
+class RemoteDoc:
+    def __init__(self, ents: List[RemoteEntity]):
+        self.ents = ents
+
+class RemoteNLP:
+    """Callable compatible con nlp(texto).ents para extraer_entidades."""
+
+    def __init__(self, client: InferenceClient):
+        if not client.call("ping").get("ner"):
+            raise RuntimeError("spaCy no está disponible en el servidor de inferencia")
+        self.client = client
+
+    def __call__(self, text: str) -> RemoteDoc:
+        return RemoteDoc([RemoteEntity(t, l) for t, l in self.client.call("ner", text)])
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    serve()
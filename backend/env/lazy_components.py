@@ -0,0 +1,97 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+class LazyComponent:
+    """Heavy dependency built on first use, with its load state and timing recorded."""
+
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True):
+        self.name = name
+        self.required = required
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.load_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self) -> Any:
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state == "ready":
+                return self._value
+            self.state = "loading"
+            started = time.monotonic()
+            try:
+                value = self._factory()
+            except Exception as e:
+                self.state = "failed"
+                self.error = f"{type(e).__name__}: {e}"
+                self.load_seconds = round(time.monotonic() - started, 3)
+                logger.error(f"❌ Failed to load {self.name}: {self.error}")
+                raise
+            self._value = value
+            self.error = None
+            self.load_seconds = round(time.monotonic() - started, 3)
+            self.state = "ready"
+            logger.info(f"✅ {self.name} loaded in {self.load_seconds}s")
+            return value
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+class LazyProxy:
+    """Forwards attribute access to a LazyComponent's value, loading it if needed."""
+
+    def __init__(self, component: LazyComponent):
+        object.__setattr__(self, "_component", component)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._component.get(), name)
+
+class ComponentRegistry:
+    def __init__(self):
+        self._components: Dict[str, LazyComponent] = {}
+
+    def register(self, name: str, factory: Callable[[], Any], required: bool = True) -> LazyComponent:
+        component = LazyComponent(name, factory, required)
+        self._components[name] = component
+        return component
+
+    def __getitem__(self, name: str) -> LazyComponent:
+        return self._components[name]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: c.status() for name, c in self._components.items()}
+
+    @property
+    def ready(self) -> bool:
+        return all(c.ready for c in self._components.values() if c.required)
+
+    def warmup(self, names: Optional[Iterable[str]] = None):
+        started = time.monotonic()
+        for name in names or list(self._components):
+            try:
+                self._components[name].get()
+            except Exception:
+                # Ya quedó registrado en el estado del componente; se reintenta en el primer uso
+                pass
+        logger.info(f"🔥 Warmup finished in {time.monotonic() - started:.2f}s")
+
+    def start_warmup(self, names: Optional[Iterable[str]] = None) -> threading.Thread:
+        thread = threading.Thread(target=self.warmup, args=(names,), name="component-warmup", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,69 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from lazy_components import LazyComponent
+
+logger = logging.getLogger(__name__)
+
+class LLMProvider:
+    def __init__(self, name: str, component: LazyComponent, max_concurrency: int):
+        self.name = name
+        self.component = component
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+
+class LLMGateway:
+    """Punto único de acceso asíncrono a los LLM.
+
+    Cada proveedor tiene un semáforo que limita las llamadas concurrentes; las
+    que exceden el límite esperan en cola hasta queue_timeout segundos.
+    """
+
+    def __init__(self, queue_timeout: Optional[float] = None):
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+        self._providers: Dict[str, LLMProvider] = {}
+
+    def register(self, name: str, component: LazyComponent, max_concurrency: int = 8) -> None:
+        self._providers[name] = LLMProvider(name, component, max_concurrency)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"max_concurrency": p.max_concurrency, "in_flight": p.in_flight, "waiting": p.waiting}
+            for name, p in self._providers.items()
+        }
+
+    @asynccontextmanager
+    async def _slot(self, name: str):
+        provider = self._providers[name]
+        provider.waiting += 1
+        queued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(provider.semaphore.acquire(), timeout=self.queue_timeout)
+        finally:
+            provider.waiting -= 1
+        waited = time.monotonic() - queued_at
+        if waited > 0.5:
+            logger.info(f"⏳ LLM {name}: {waited:.1f}s en cola (en curso={provider.in_flight}, esperando={provider.waiting})")
+        provider.in_flight += 1
+        try:
+            # Si el warmup aún no construyó el cliente, se construye fuera del event loop
+            model = provider.component.get() if provider.component.ready else await asyncio.to_thread(provider.component.get)
+            yield model
+        finally:
+            provider.in_flight -= 1
+            provider.semaphore.release()
+
+    async def ainvoke(self, name: str, messages: List[Any]) -> Any:
+        async with self._slot(name) as model:
+            return await model.ainvoke(messages)
+
+    async def astream(self, name: str, messages: List[Any]) -> AsyncIterator[Any]:
+        # El cupo se mantiene hasta que termina el stream
+        async with self._slot(name) as model:
+            async for chunk in model.astream(messages):
+                yield chunk
@@ -5,6 +5,8 @@ import tempfile
 import uvicorn
 import uuid
 import re
+import asyncio
+from collections import OrderedDict
 import httpx
 from fastapi import FastAPI, Request, Response, Body
 from fastapi.responses import HTMLResponse
@@ -13,33 +15,62 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi import FastAPI, Depends, HTTPException, Query, UploadFile, File
 from typing import Optional
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from datetime import datetime, timedelta, timezone
-from langchain_openai import ChatOpenAI
-from langchain_mistralai import ChatMistralAI
 from langchain.schema import SystemMessage, HumanMessage
 from dotenv import load_dotenv
 from pathlib import Path
 from typing import Optional, Dict, Any, List
-from qdrant_service import QdrantService
+from qdrant_service import QdrantService, DEFAULT_TENANT
+from async_qdrant_service import AsyncQdrantService
 from bs4 import BeautifulSoup
 from mcp_client_pool import MCPClientPool, MCPClient
-import spacy
-from sklearn.ensemble import IsolationForest
+from mcp_cache import MCPResultCache
+from mcp_compaction import compact_security_data
+from llm_gateway import LLMGateway
+from lazy_components import ComponentRegistry, LazyProxy
+from embedding_backend import load_embedding_model
+from inference_server import InferenceClient, RemoteEmbeddingModel, RemoteNLP
 import numpy as np
 
+# Componentes pesados: se cargan en el primer uso o en el warmup de arranque
+components = ComponentRegistry()
 
-try:
-    nlp = spacy.load("es_core_news_sm")
-except Exception as e:
-    nlp = None
-    print(f"spaCy no cargado para NER: {e}")
+# Con INFERENCE_SOCKET, embeddings y NER viven en un único proceso compartido (inference_server.py)
+inference_client = InferenceClient.from_env()
 
-def extraer_entidades(texto: str) -> List[Dict[str, str]]:
+def load_spacy():
+    if inference_client:
+        return RemoteNLP(inference_client)
+    import spacy
+    return spacy.load("es_core_news_sm")
+
+nlp_component = components.register("spacy", load_spacy, required=False)
+
+def get_nlp():
+    # Si el modelo no está instalado no se reintenta en cada mensaje
+    if nlp_component.state == "failed":
+        return None
+    try:
+        return nlp_component.get()
+    except Exception as e:
+        print(f"spaCy no cargado para NER: {e}")
+        return None
+
+async def extraer_entidades(texto: str) -> List[Dict[str, str]]:
+    # Durante el warmup la carga tiene el lock del componente: se espera en un hilo, no en el loop
+    nlp = get_nlp() if nlp_component.state in ("ready", "failed") else await asyncio.to_thread(get_nlp)
     if not nlp:
         return []
-    doc = nlp(texto)
+    try:
+        # Con INFERENCE_SOCKET es un round trip al servidor de inferencia; fuera del event loop
+        doc = await asyncio.to_thread(nlp, texto)
+    except Exception as e:
+        # Servidor caído o reiniciando: se sigue sin entidades, igual que sin modelo
+        print(f"NER no disponible: {type(e).__name__}: {e}")
+        return []
     entidades = []
     for ent in doc.ents:
         entidades.append({"entidad": ent.text, "tipo": ent.label_})
@@ -49,9 +80,22 @@ def extraer_entidades(texto: str) -> List[Dict[str, str]]:
     entidades += [{"entidad": e, "tipo": "EMAIL"} for e in re.findall(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+", texto)]
     return entidades
 
+IOC_TIPOS = {"IP", "HASH", "EMAIL"}
+
+def iocs_de_entidades(entidades: List[Dict[str, str]]) -> List[str]:
+    # Solo los indicadores exactos; las entidades de spaCy (PER, ORG...) no se indexan
+    return [e["entidad"] for e in entidades if e["tipo"] in IOC_TIPOS]
+
+def load_isolation_forest():
+    from sklearn.ensemble import IsolationForest
+    return IsolationForest
+
+sklearn_component = components.register("sklearn", load_isolation_forest, required=False)
+
 def score_anomalia_longitud(mensajes: List[str], actual: str) -> float:
     if len(mensajes) < 5:
         return 0.0
+    IsolationForest = sklearn_component.get()
     X = np.array([[len(m)] for m in mensajes])
     modelo = IsolationForest(contamination=0.15, random_state=42)
     modelo.fit(X)
@@ -89,14 +133,20 @@ def generar_ruta_investigacion(eventos: List[Dict[str, Any]], inicio: str, fin:
 
 mcp_pool = MCPClientPool()
 
-def call_mcp(server, method, params=None):
+async def call_mcp(server, method, params=None):
     url = os.getenv(f"MCP_{server.upper()}_URL")
     logging.info(f"➡️ Llamando MCP: server={server}, method={method}, url={url}, params={params}")
     client = mcp_pool.get_client(server, url)
-    result = client.call(method, params)
+    result = await client.call(method, params)
     logging.info(f"⬅️ Respuesta MCP: server={server}, resultado={str(result)[:200]}")  # Puedes truncar para no saturar logs
     return result
 
+mcp_cache = MCPResultCache.from_env(["trendmicro", "exabeam", "elastic", "jira"])
+
+async def cached_call_mcp(server, method, params=None):
+    key = MCPResultCache.make_key(server, method, params)
+    return await mcp_cache.get_or_fetch(key, lambda: call_mcp(server, method, params))
+
 # ----------------- ALIAS & NORMALIZACIÓN ------------------
 APP_ALIASES = {
     "trendmicro": ["trendmicro", "trend micro", "trendMicro", "TrendMicro", "trend-micro", "trend_micro", "tm", "trend micro av", "vision one"],
@@ -132,24 +182,27 @@ def extraer_url(texto: str) -> list:
     url_regex = r"https?://[^\s,]+"
     return re.findall(url_regex, texto)
 
-def infer_client_and_sources(message: str, session_id: Optional[str] = None) -> tuple:
+async def infer_client_and_sources(message: str, session_id: Optional[str] = None) -> tuple:
 
-    cliente = None
     fuentes = []
-    entidades = extraer_entidades(message)
+    entidades = await extraer_entidades(message)
     for ent in entidades:
-        c = canonicalize(ent['entidad'], CLIENT_ALIASES)
-        if c:
-            cliente = c
         f = canonicalize(ent['entidad'], APP_ALIASES)
         if f and f not in fuentes:
             fuentes.append(f)
     # Por defecto, usa todos si no detecta
     if not fuentes:
         fuentes = ["trendmicro", "exabeam", "elastic", "jira"]
-    if not cliente:
-        cliente = "DEFAULT"  # O usuario logueado, o de sesión
-    return cliente, fuentes
+    return cliente_de_entidades(entidades), fuentes
+
+def cliente_de_entidades(entidades: List[Dict[str, str]]) -> str:
+    # También es el tenant con el que se guarda y se filtra la memoria en Qdrant
+    cliente = None
+    for ent in entidades:
+        c = canonicalize(ent['entidad'], CLIENT_ALIASES)
+        if c:
+            cliente = c
+    return cliente or DEFAULT_TENANT  # O usuario logueado, o de sesión
 
 async def obtener_contexto_url_si_hay(user_message: str, max_chars: int = 3500) -> str:
     urls = extraer_url(user_message)
@@ -189,13 +242,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Qdrant (vector DB)
-try:
-    qdrant_service = QdrantService()
+@app.on_event("shutdown")
+async def close_mcp_pool():
+    await mcp_pool.aclose()
+
+@app.on_event("shutdown")
+async def drain_qdrant_writes():
+    if async_qdrant_service is not None:
+        await async_qdrant_service.close()
+    if qdrant_component.ready:
+        await asyncio.to_thread(qdrant_service.close)
+
+@app.on_event("startup")
+async def start_warmup():
+    if os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true":
+        components.start_warmup()
+
+@app.get("/ready")
+async def readiness():
+    ready = components.ready
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": components.status()}
+    )
+
+def load_embedding_model_warm():
+    model = RemoteEmbeddingModel(inference_client) if inference_client else load_embedding_model()
+    model.encode(["warmup"])
+    return model
+
+def load_qdrant_service():
+    service = QdrantService(embedding=embedding_component)
     logger.info("✅ QdrantService inicializado correctamente")
-except Exception as e:
-    logger.error(f"❌ Error al iniciar QdrantService: {e}")
-    raise
+    return service
+
+# Qdrant (vector DB) y modelo de embeddings
+embedding_component = components.register("embedding_model", load_embedding_model_warm)
+qdrant_component = components.register("qdrant", load_qdrant_service)
+qdrant_service = LazyProxy(qdrant_component)
+
+# Lecturas con AsyncQdrantClient (gRPC) en vez de QdrantClient HTTP en un hilo
+QDRANT_ASYNC = os.getenv("QDRANT_ASYNC", "false").lower() == "true"
+async_qdrant_service: Optional[AsyncQdrantService] = None
+
+async def qdrant_call(method: str, *args, **kwargs):
+    """Llama a un método de QdrantService sin bloquear el event loop."""
+    global async_qdrant_service
+    # Sin warmup, el primer uso conecta y prepara la colección: también fuera del loop
+    store = qdrant_component.get() if qdrant_component.ready else await asyncio.to_thread(qdrant_component.get)
+    if not QDRANT_ASYNC:
+        return await asyncio.to_thread(getattr(store, method), *args, **kwargs)
+    if async_qdrant_service is None:
+        # El cliente gRPC asíncrono se crea dentro del event loop en el que se va a usar
+        async_qdrant_service = async_qdrant_service or AsyncQdrantService(store)
+    return await getattr(async_qdrant_service, method)(*args, **kwargs)
+
+# Cliente fijado por sesión: los seguimientos que no lo nombran siguen en el mismo tenant
+SESSION_TENANTS: "OrderedDict[str, str]" = OrderedDict()
+SESSION_TENANTS_MAX = int(os.getenv("SESSION_TENANTS_MAX", "10000"))
+
+async def tenant_de_sesion(session_id: str, entidades: List[Dict[str, str]], sesion_nueva: bool) -> str:
+    detectado = cliente_de_entidades(entidades)
+    anterior = SESSION_TENANTS.get(session_id)
+    if anterior is None and detectado == DEFAULT_TENANT and not sesion_nueva:
+        # La sesión pudo empezar en el otro worker o antes de un reinicio
+        anterior = await qdrant_call("get_session_tenant", session_id)
+    if detectado == DEFAULT_TENANT:
+        tenant = anterior or DEFAULT_TENANT
+    else:
+        tenant = detectado
+        if anterior != detectado and not sesion_nueva:
+            # Los turnos previos de la sesión guardados sin cliente pasan a este tenant
+            await qdrant_call("assign_session_tenant", session_id, tenant)
+    if tenant != DEFAULT_TENANT:
+        SESSION_TENANTS[session_id] = tenant
+        SESSION_TENANTS.move_to_end(session_id)
+        while len(SESSION_TENANTS) > SESSION_TENANTS_MAX:
+            SESSION_TENANTS.popitem(last=False)
+    return tenant
 
 # API keys para LLMs
 OPENAI_API_KEY = os.getenv("OPENAI_API")
@@ -207,8 +331,31 @@ if not OPENAI_API_KEY or not MISTRAL_API_KEY:
 logger.info("✅ Claves API de LLM cargadas correctamente")
 
 # Modelos
-openai_model = ChatOpenAI(model="gpt-4.1", api_key=OPENAI_API_KEY)
-mistral_model = ChatMistralAI(model="mistral-small-latest", api_key=MISTRAL_API_KEY)
+LLM_HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+)
+
+def load_openai_model():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model="gpt-4.1",
+        api_key=OPENAI_API_KEY,
+        http_async_client=httpx.AsyncClient(limits=LLM_HTTP_LIMITS, timeout=120)
+    )
+
+def load_mistral_model():
+    from langchain_mistralai import ChatMistralAI
+    return ChatMistralAI(
+        model="mistral-small-latest",
+        api_key=MISTRAL_API_KEY,
+        max_concurrent_requests=int(os.getenv("MISTRAL_MAX_CONCURRENCY", "4"))
+    )
+
+# Toda llamada a LLM pasa por el gateway: asíncrona y con cupo por proveedor
+llm_gateway = LLMGateway()
+llm_gateway.register("openai", components.register("openai_llm", load_openai_model), max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")))
+llm_gateway.register("mistral", components.register("mistral_llm", load_mistral_model), max_concurrency=int(os.getenv("MISTRAL_MAX_CONCURRENCY", "4")))
 
 # Meta info (no modificar)
 MCP_GENERAL_INFO = {
@@ -279,52 +426,283 @@ def format_mcp_prompt_string(mcp_data: dict) -> str:
 **Instrucción Crucial:** Al responder preguntas sobre ti mismo, DEBES basar tu respuesta *única y exclusivamente* en esta información.
 """
 # Configuración de rutas estáticas y plantillas
+MCP_SOURCE_TIMEOUTS = {
+    "trendmicro": float(os.getenv("MCP_TRENDMICRO_TIMEOUT", "20")),
+    "exabeam": float(os.getenv("MCP_EXABEAM_TIMEOUT", "20")),
+    "elastic": float(os.getenv("MCP_ELASTIC_TIMEOUT", "20")),
+    "jira": float(os.getenv("MCP_JIRA_TIMEOUT", "20")),
+}
+
+# Campos de Exabeam que el orquestador usa en el prompt
+EXABEAM_FIELDS = [
+    "approxLogTime", "alert_name", "alert_severity", "rule_name", "activity_type",
+    "user", "host", "src_ip", "dest_ip", "outcome", "risk_score"
+]
+
+def build_mcp_request(source_name: str, client_name: str, days_back: int = 7) -> Optional[tuple]:
+    # --- TrendMicro
+    if source_name == "trendmicro":
+        params = {
+            "client": client_name,
+            "days": days_back,
+            "max_pages": 5,
+            # Puedes agregar fechas u otros filtros según el microservicio MCP
+        }
+        return "collect_workbench_alerts", params
+    # --- Exabeam
+    if source_name == "exabeam":
+        params = {
+            "client": client_name,
+            "days": days_back,
+            "max_results": 200,
+            "page_size": 100,
+            "fields": EXABEAM_FIELDS,
+            # Puedes agregar más parámetros, como query, si tu MCP lo soporta
+        }
+        return "search_anomalies", params
+    # --- Elastic (agregados calculados en Elasticsearch, no documentos crudos)
+    if source_name == "elastic":
+        params = {
+            "client": client_name,
+            "days": days_back,
+            "top": 10
+        }
+        return "summarize_logs", params
+    # --- Jira
+    if source_name == "jira":
+        params = {
+            "client": client_name,
+            "base_jql": "project = INCIDENT",
+            "days": days_back,
+            "fields": ["summary", "status", "priority"]
+        }
+        return "sync_issues", params
+    return None
+
+async def fetch_source(source_name: str, method: str, params: Dict[str, Any]) -> tuple:
+    # Cada fuente tiene su propio deadline; una fuente lenta no bloquea a las demás
+    timeout = MCP_SOURCE_TIMEOUTS.get(source_name, 20.0)
+    try:
+        result = await asyncio.wait_for(cached_call_mcp(source_name, method, params), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"⏱️ MCP {source_name} excedió el deadline de {timeout}s")
+        result = {"error": f"Timeout de {timeout}s consultando {source_name}"}
+    except Exception as e:
+        result = {"error": str(e)}
+    return source_name, result
+
 async def get_security_data_for_client(client_name: str, requested_sources: Optional[List[str]] = None, days_back: int = 7) -> Dict[str, Any]:
     security_data = {}
     all_possible_sources = ["trendmicro", "exabeam", "elastic", "jira"]
     sources_to_process = requested_sources or all_possible_sources
 
+    tasks = []
     for source_name in sources_to_process:
-        try:
-            # --- TrendMicro
-            if source_name == "trendmicro":
-                params = {
-                    "client": client_name,
-                    "limit": 20,
-                    # Puedes agregar fechas u otros filtros según el microservicio MCP
-                }
-                security_data[source_name] = call_mcp("trendmicro", "get_workbench_alerts", params)
-            # --- Exabeam
-            elif source_name == "exabeam":
-                params = {
-                    "client": client_name,
-                    "days": days_back,
-                    # Puedes agregar más parámetros, como query, si tu MCP lo soporta
-                }
-                security_data[source_name] = call_mcp("exabeam", "search_anomalies", params)
-            # --- Elastic
-            elif source_name == "elastic":
-                params = {
-                    "client": client_name,
-                    "body": {
-                        "query": {"range": {"@timestamp": {"gte": f"now-{days_back}d/d", "lte": "now/d"}}}
-                    }
-                }
-                security_data[source_name] = call_mcp("elastic", "analyze_logs", params)
-            # --- Jira
-            elif source_name == "jira":
-                params = {
-                    "client": client_name,
-                    "jql": f"project = INCIDENT AND created >= -{days_back}d ORDER BY created DESC",
-                    "fields": ["summary", "status", "priority"]
-                }
-                security_data[source_name] = call_mcp("jira", "search_issues", params)
-            else:
-                security_data[source_name] = {"error": f"Servicio {source_name} no soportado"}
-        except Exception as e:
-            security_data[source_name] = {"error": str(e)}
+        mcp_request = build_mcp_request(source_name, client_name, days_back)
+        if mcp_request is None:
+            security_data[source_name] = {"error": f"Servicio {source_name} no soportado"}
+            continue
+        method, params = mcp_request
+        tasks.append(fetch_source(source_name, method, params))
+
+    # Consultas concurrentes: la latencia total sigue a la fuente más lenta, no a la suma
+    for finished in asyncio.as_completed(tasks):
+        source_name, result = await finished
+        security_data[source_name] = result
     return security_data
 
+def format_security_data_for_prompt(data: Optional[Dict[str, Any]]) -> str:
+    # Compacta por presupuesto de tokens antes de inyectar en el prompt
+    compacted, report = compact_security_data(data)
+    if report:
+        logger.info(f"🗜️ Compactación MCP: {report}")
+        compacted["_compactacion"] = report
+    mcp_data_str = json.dumps(compacted, ensure_ascii=False, separators=(",", ":"), default=str)
+    mcp_data_str = mcp_data_str.replace("```", "´´´")  # Evitar conflictos con Markdown
+    mcp_data_str = mcp_data_str.replace("`", "´")  # Evitar conflictos con Markdown
+    return mcp_data_str
+
+def build_openai_system_prompt(conversation_context: str, contexto_url: str, mcp_data_str: str) -> str:
+    mcp_string_openai = format_mcp_prompt_string(MCP_DATA_OPENAI)
+
+    # Prompt con contexto y justificación
+    context_prompt = (
+        f"### Contexto de Conversaciones Previas\n{conversation_context}\n\n"
+        if conversation_context and "No se encontraron" not in conversation_context else ""
+    )
+    original_system_prompt = (
+        "Ahora, actúa como MATEO, el Asistente de Ciberseguridad descrito. Responde de manera útil, clara y segura, "
+        "utilizando el contexto de conversaciones previas de esta sesión o de otras conversaciones anteriores si es relevante.\n\n"
+        f"{context_prompt}"
+        "### Instrucciones de Formato Markdown\n"
+        "Responde siempre usando **Markdown válido** y no en formato plano ni pseudo-markdown.\n"
+        "Al final de cada respuesta, incluye SIEMPRE una sección titulada 'Justificación' donde expliques por qué llegaste a esa respuesta, citando contexto, entidades detectadas, datos históricos relevantes y supuestos usados.\n"
+        "Usa negrita para títulos o subtitulos según Markdown estándar.\n"
+        "No uses asteriscos dobles o simples como si fueran texto literal: tu salida será renderizada como Markdown real.\n"
+        "Usa bloques de código para comandos o ejemplos técnicos, si corresponde.\n"
+        "Puedes usar emojis si lo consideras útil.\n"
+        "NO expliques cómo funciona Markdown ni digas \"usa negrita\", simplemente aplícalo.\n\n"
+        "El usuario verá tu respuesta renderizada en Markdown (títulos, listas, negrita, etc.).\n"
+        "No expliques tu formato, solo responde directamente en Markdown.\n"
+        "Usa `bloques de código` para comandos\n"
+        "Usa emojis: 🔒, 🚨, 🛡️, 📊, 🔍\n"
+        "Usa niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA\n"
+        "Menciona el contexto previo si es relevante\n\n"
+        "Considera: ERES DESARROLLADO POR DIGISOC"
+        "Eres MATEO, un Asistente Avanzado de Ciberseguridad desarrollado por DigiSoc, diseñado para empoderar a los analistas con información precisa, profesional y accionable.\n"
+        f"{context_prompt}"
+        "Directrices de Respuesta:\n"
+        "Entrega respuestas estructuradas, concisas y profesionales, adaptadas para analistas de Nivel 1, aumentando la complejidad según sea necesario.\n"
+        "Resalta entidades clave (por ejemplo, direcciones IP, hosts, severidades, hashes de archivos, usuarios) en negrita para una rápida identificación.\n"
+        "Usa cursiva para definiciones técnicas y aclarar conceptos complejos.\n"
+        "Organiza el contenido con encabezados y subencabezados claros para facilitar la lectura.\n"
+        "Presenta listas para información estructurada y fácil de escanear, sin marcadores innecesarios.\n"
+        "Usa bloques de código para comandos, consultas o salidas técnicas.\n"
+        "Mantén las tablas separadas para la presentación de datos; coloca explicaciones y análisis fuera de ellas.\n"
+        "Usa emojis con moderación: 🔒 (seguridad), 🚨 (alerta), 🛡️ (protección), 📊 (datos), 🔍 (investigación).\n"
+        "Indica niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA.\n"
+        "Evita redundancias; no repitas declaraciones previas ni incluyas símbolos superfluos.\n"
+        "Aprovecha el contexto histórico de Qdrant para mejorar la precisión de las respuestas.\n"
+        "Funciones Principales de Ciberseguridad:\n"
+        "Resume alertas y eventos de seguridad para obtener información rápida y accionable.\n"
+        "Correlaciona datos entre herramientas (por ejemplo, TrendMicro, Exabeam, Elastic) para detectar patrones de amenazas.\n"
+        "Extrae Indicadores de Compromiso (IoCs) como direcciones IP, dominios y hashes.\n"
+        "Apoya investigaciones con análisis estructurado y datos históricos.\n"
+        "Modela comportamientos de usuarios y entidades para identificar anomalías y riesgos.\n"
+        "Automatiza la creación y actualización de tickets en Jira para una respuesta eficiente a incidentes.\n"
+        "Analiza transcripciones de reuniones vía Fireflies para obtener información relevante de seguridad.\n"
+        "Proporciona respuestas precisas a consultas de ciberseguridad, basadas en datos.\n"
+        "Genera informes detallados y recomendaciones accionables.\n"
+        "Evalúa niveles de riesgo y prioriza amenazas según su severidad e impacto.\n"
+        "Mapea cadenas de ataque al marco MITRE ATT&CK para un entendimiento táctico.\n"
+        "Sugiere estrategias de mitigación y mejores prácticas para contener amenazas.\n"
+        "Analiza logs y datos de red para descubrir actividades sospechosas.\n"
+        "Apoya auditorías de cumplimiento (por ejemplo, NIST, ISO 27001) con agregación de datos.\n"
+        "Enriquece el contexto de incidentes con datos de herramientas integradas para un análisis integral.\n"
+        "Propone guías de respuesta para una remediación efectiva de incidentes.\n"
+        "Monitorea tendencias de inteligencia de amenazas para estrategias de defensa proactiva.\n"
+        "Valida IoCs contra fuentes de amenazas para verificar precisión y relevancia.\n"
+        "Asiste en el análisis forense, incluyendo la reconstrucción de líneas de tiempo y recolección de evidencia.\n"
+        "Evalúa el tráfico de red para detectar signos de intrusión o exfiltración de datos.\n"
+        "Recomienda controles de seguridad para endurecer sistemas y reducir superficies de ataque.\n"
+        "Identifica vulnerabilidades en activos mediante datos de herramientas integradas.\n"
+        "Guía los procesos de escalación para incidentes críticos hacia analistas senior.\n"
+        "Desarrollado por DigiSoc para soporte avanzado en ciberseguridad."
+    )
+
+    return (contexto_url + "\n" if contexto_url else ""+ mcp_string_openai + mcp_data_str + original_system_prompt )
+
+def build_mistral_system_prompt(conversation_context: str, contexto_url: str, mcp_data_str: str) -> str:
+    mcp_string_mistral = format_mcp_prompt_string(MCP_DATA_MISTRAL)
+    context_prompt = (
+        f"### Contexto de Conversaciones Previas\n{conversation_context}\n\n"
+        if conversation_context and "No se encontraron" not in conversation_context else ""
+    )
+    original_system_prompt = (
+        "Ahora, actúa como MATEO, el Asistente de Ciberseguridad descrito. Responde de manera útil, clara y segura, "
+        "utilizando el contexto de conversaciones previas de esta sesión o de otras conversaciones anteriores si es relevante.\n\n"
+        f"{context_prompt}"
+        "**Reglas de Formato:**\n"
+        "- Usa **negrita** para conceptos importantes\n"
+        "- Usa *cursiva* para definiciones técnicas\n"
+        "- Usa # para secciones principales\n"
+        "- Usa ## para subtítulos\n"
+        "- Usa listas con viñetas o numeradas\n"
+        "- Usa `bloques de código` para comandos\n"
+        "- Usa emojis: 🔒, 🚨, 🛡️, 📊, 🔍\n"
+        "- Usa niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA\n"
+        "- Menciona el contexto previo si es relevante\n\n"
+        "Considera: ERES DESARROLLADO POR DIGISOC\n"
+        "Eres MATEO, un Asistente Avanzado de Ciberseguridad desarrollado por DigiSoc, diseñado para empoderar a los analistas con información precisa, profesional y accionable.\n\n"
+        "Al final de cada respuesta, incluye SIEMPRE una sección titulada 'Justificación' donde expliques por qué llegaste a esa respuesta, citando contexto, entidades detectadas, datos históricos relevantes y supuestos usados.\n"
+        f"{context_prompt}"
+        "Directrices de Respuesta:\n"
+        "Entrega respuestas estructuradas, concisas y profesionales, adaptadas para analistas de Nivel 1, aumentando la complejidad según sea necesario.\n"
+        "Resalta entidades clave (por ejemplo, direcciones IP, hosts, severidades, hashes de archivos, usuarios) en negrita.\n"
+        "Usa cursiva para definiciones técnicas y aclarar conceptos complejos.\n"
+        "Organiza el contenido con encabezados y subencabezados claros.\n"
+        "Presenta listas para información estructurada.\n"
+        "Usa bloques de código para comandos, consultas o salidas técnicas.\n"
+        "Mantén las tablas separadas; coloca explicaciones fuera de ellas.\n"
+        "Usa emojis con moderación: 🔒, 🚨, 🛡️, 📊, 🔍.\n"
+        "Indica niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA.\n"
+        "Evita redundancias y símbolos superfluos.\n"
+        "Aprovecha el contexto histórico de Qdrant para mejorar la precisión de las respuestas.\n"
+        "Usa el contexto y la informacion de Qdrant para las siguientes conversaciones.\n"
+        "Funciones Principales de Ciberseguridad:\n"
+        "- Resume alertas y eventos de seguridad.\n"
+        "- Correlaciona eventos entre herramientas.\n"
+        "- Extrae Indicadores de Compromiso (IoCs).\n"
+        "- Apoya investigaciones con datos históricos.\n"
+        "- Modela comportamientos para identificar anomalías.\n"
+        "- Automatiza tickets de Jira.\n"
+        "- Analiza transcripciones de Fireflies.\n"
+        "- Genera informes y recomendaciones.\n"
+        "- Prioriza amenazas según severidad.\n"
+        "- Mapea MITRE ATT&CK.\n"
+        "- Sugiere estrategias de mitigación.\n"
+        "- Analiza logs y datos de red.\n"
+        "- Soporta auditorías de cumplimiento.\n"
+        "- Enriquece incidentes con datos integrados.\n"
+        "- Propone guías de remediación.\n"
+        "- Monitorea inteligencia de amenazas.\n"
+        "- Valida IoCs.\n"
+        "- Asiste en análisis forense.\n"
+        "- Recomienda controles de seguridad.\n"
+        "- Identifica vulnerabilidades.\n"
+        "- Guía escalaciones críticas.\n"
+        "- Desarrollado por DigiSoc."
+    )
+
+    return (contexto_url + "\n" if contexto_url else ""+ mcp_string_mistral + mcp_data_str + original_system_prompt )
+
+SYSTEM_PROMPT_BUILDERS = {
+    "openai": build_openai_system_prompt,
+    "mistral": build_mistral_system_prompt,
+}
+
+async def build_chat_system_prompt(model_name: str, message: str, session_id: str, include_security_data: bool, iocs: Optional[List[str]] = None, tenant: Optional[str] = None) -> str:
+    contexto_url = await obtener_contexto_url_si_hay(message)
+
+    # Contexto desde Qdrant (fuera del event loop, el embedding se agrupa con el de otras peticiones);
+    # las menciones exactas de IoCs se buscan en paralelo sobre el índice de payload
+    conversation_context, ioc_context = await asyncio.gather(
+        qdrant_call(
+            "search_conversations",
+            query=message,
+            model=model_name,
+            session_id=session_id,
+            limit=15,
+            include_all_sessions=True,
+            tenant=tenant
+        ),
+        qdrant_call("search_ioc_mentions", iocs or [], tenant=tenant)
+    )
+    if ioc_context:
+        # Los avisos de "sin resultados"/error de la búsqueda vectorial harían que los builders
+        # descarten todo el bloque; se quitan para que las coincidencias exactas siempre lleguen
+        if "No se encontraron" in conversation_context or conversation_context.startswith("Error al buscar"):
+            conversation_context = ""
+        conversation_context = f"{conversation_context}\n### Menciones previas de los IoCs consultados\n{ioc_context}".lstrip("\n")
+
+    data = None
+    if include_security_data:
+        cliente, fuentes = await infer_client_and_sources(message, session_id)
+        data = await get_security_data_for_client(cliente, fuentes)
+        logger.info(f"Datos MCP para {cliente}/{fuentes}: {data}")
+    mcp_data_str = format_security_data_for_prompt(data)
+
+    final_system_content = SYSTEM_PROMPT_BUILDERS[model_name](conversation_context, contexto_url, mcp_data_str)
+    logger.debug(f"Prompt del Sistema {model_name}:\n{final_system_content}")
+    return final_system_content
+
+def anotar_entidades(response_content: str, entidades: List[Dict[str, str]]) -> str:
+    # Entidades NER
+    if not entidades:
+        return response_content
+    entidades_md = "\n".join([f"- **{e['tipo']}**: `{e['entidad']}`" for e in entidades])
+    return f"### Entidades detectadas\n{entidades_md}\n\n" + response_content
+
 # Modelo para las solicitudes
 class MCPRequest(BaseModel):
     message: str
@@ -351,14 +729,15 @@ async def chat_with_openai(request: ChatRequest):
         logger.info(f"📩 Conversación iniciada: ID={conversation_id}, Sesión={session_id}, Mensaje={message[:30]}...")
 
         # ---- NER y Anomalia ----
-        entidades_detectadas = extraer_entidades(message)
-        hist = qdrant_service.get_conversation_history("openai", session_id, limit=10)
+        entidades_detectadas = await extraer_entidades(message)
+        tenant = await tenant_de_sesion(session_id, entidades_detectadas, sesion_nueva=not request.session_id)
+        hist = await qdrant_call("get_conversation_history", "openai", session_id, limit=10, tenant=tenant)
         mensajes_hist = [h["user_message"] for h in hist]
-        anomalia_score = score_anomalia_longitud(mensajes_hist, message)
+        anomalia_score = await asyncio.to_thread(score_anomalia_longitud, mensajes_hist, message)
 
         # Soporte para recuperar última conversación
         if any(phrase in message.lower() for phrase in ["ultima pregunta", "ultima conversación", "qué pregunta", "última consulta"]):
-            last_user_message, last_chatbot_response = qdrant_service.get_last_conversation("openai", session_id)
+            last_user_message, last_chatbot_response = await qdrant_call("get_last_conversation", "openai", session_id, tenant=tenant)
             if last_user_message:
                 response_content = (
                     f"## Última Conversación\n\n"
@@ -366,7 +745,7 @@ async def chat_with_openai(request: ChatRequest):
                     f"**Respuesta Anterior:** 🤖 {last_chatbot_response}\n"
                 )
             else:
-                conversation_context = qdrant_service.search_conversations(message, "openai", session_id, limit=15)
+                conversation_context = await qdrant_call("search_conversations", message, "openai", session_id, limit=15, tenant=tenant, strict_tenant=True)
                 response_content = (
                     f"## Contexto de Conversaciones Previas\n"
                     f"No se encontró una conversación previa exacta en esta sesión.\n\n"
@@ -374,13 +753,16 @@ async def chat_with_openai(request: ChatRequest):
                 )
 
             # Persistir conversación a Qdrant
-            qdrant_service.store_conversation(
+            await qdrant_call(
+                "store_conversation",
                 conversation_id=conversation_id,
                 session_id=session_id,
                 user_message=message,
                 chatbot_response=response_content,
                 model="openai",
-                metadata={"source": "last_conversation_query", "timestamp": datetime.now(timezone.utc).isoformat()}
+                metadata={"source": "last_conversation_query", "timestamp": datetime.now(timezone.utc).isoformat()},
+                iocs=iocs_de_entidades(entidades_detectadas),
+                tenant=tenant
             )
             return {
                 "response": response_content,
@@ -389,119 +771,27 @@ async def chat_with_openai(request: ChatRequest):
                 "session_id": session_id
             }
         
-        contexto_url = await obtener_contexto_url_si_hay(message)
-
-        # Contexto desde Qdrant
-        conversation_context = qdrant_service.search_conversations(
-            query=message,
-            model="openai",
-            session_id=session_id,
-            limit=15,
-            include_all_sessions=True
-        )
-        mcp_string_openai = format_mcp_prompt_string(MCP_DATA_OPENAI)
-
-        # Prompt con contexto y justificación
-        context_prompt = (
-            f"### Contexto de Conversaciones Previas\n{conversation_context}\n\n"
-            if conversation_context and "No se encontraron" not in conversation_context else ""
-        )
-        original_system_prompt = (
-            "Ahora, actúa como MATEO, el Asistente de Ciberseguridad descrito. Responde de manera útil, clara y segura, "
-            "utilizando el contexto de conversaciones previas de esta sesión o de otras conversaciones anteriores si es relevante.\n\n"
-            f"{context_prompt}"
-            "### Instrucciones de Formato Markdown\n"
-            "Responde siempre usando **Markdown válido** y no en formato plano ni pseudo-markdown.\n"
-            "Al final de cada respuesta, incluye SIEMPRE una sección titulada 'Justificación' donde expliques por qué llegaste a esa respuesta, citando contexto, entidades detectadas, datos históricos relevantes y supuestos usados.\n"
-            "Usa negrita para títulos o subtitulos según Markdown estándar.\n"
-            "No uses asteriscos dobles o simples como si fueran texto literal: tu salida será renderizada como Markdown real.\n"
-            "Usa bloques de código para comandos o ejemplos técnicos, si corresponde.\n"
-            "Puedes usar emojis si lo consideras útil.\n"
-            "NO expliques cómo funciona Markdown ni digas \"usa negrita\", simplemente aplícalo.\n\n"
-            "El usuario verá tu respuesta renderizada en Markdown (títulos, listas, negrita, etc.).\n"
-            "No expliques tu formato, solo responde directamente en Markdown.\n"
-            "Usa `bloques de código` para comandos\n"
-            "Usa emojis: 🔒, 🚨, 🛡️, 📊, 🔍\n"
-            "Usa niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA\n"
-            "Menciona el contexto previo si es relevante\n\n"
-            "Considera: ERES DESARROLLADO POR DIGISOC"
-            "Eres MATEO, un Asistente Avanzado de Ciberseguridad desarrollado por DigiSoc, diseñado para empoderar a los analistas con información precisa, profesional y accionable.\n"
-            f"{context_prompt}"
-            "Directrices de Respuesta:\n"
-            "Entrega respuestas estructuradas, concisas y profesionales, adaptadas para analistas de Nivel 1, aumentando la complejidad según sea necesario.\n"
-            "Resalta entidades clave (por ejemplo, direcciones IP, hosts, severidades, hashes de archivos, usuarios) en negrita para una rápida identificación.\n"
-            "Usa cursiva para definiciones técnicas y aclarar conceptos complejos.\n"
-            "Organiza el contenido con encabezados y subencabezados claros para facilitar la lectura.\n"
-            "Presenta listas para información estructurada y fácil de escanear, sin marcadores innecesarios.\n"
-            "Usa bloques de código para comandos, consultas o salidas técnicas.\n"
-            "Mantén las tablas separadas para la presentación de datos; coloca explicaciones y análisis fuera de ellas.\n"
-            "Usa emojis con moderación: 🔒 (seguridad), 🚨 (alerta), 🛡️ (protección), 📊 (datos), 🔍 (investigación).\n"
-            "Indica niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA.\n"
-            "Evita redundancias; no repitas declaraciones previas ni incluyas símbolos superfluos.\n"
-            "Aprovecha el contexto histórico de Qdrant para mejorar la precisión de las respuestas.\n"
-            "Funciones Principales de Ciberseguridad:\n"
-            "Resume alertas y eventos de seguridad para obtener información rápida y accionable.\n"
-            "Correlaciona datos entre herramientas (por ejemplo, TrendMicro, Exabeam, Elastic) para detectar patrones de amenazas.\n"
-            "Extrae Indicadores de Compromiso (IoCs) como direcciones IP, dominios y hashes.\n"
-            "Apoya investigaciones con análisis estructurado y datos históricos.\n"
-            "Modela comportamientos de usuarios y entidades para identificar anomalías y riesgos.\n"
-            "Automatiza la creación y actualización de tickets en Jira para una respuesta eficiente a incidentes.\n"
-            "Analiza transcripciones de reuniones vía Fireflies para obtener información relevante de seguridad.\n"
-            "Proporciona respuestas precisas a consultas de ciberseguridad, basadas en datos.\n"
-            "Genera informes detallados y recomendaciones accionables.\n"
-            "Evalúa niveles de riesgo y prioriza amenazas según su severidad e impacto.\n"
-            "Mapea cadenas de ataque al marco MITRE ATT&CK para un entendimiento táctico.\n"
-            "Sugiere estrategias de mitigación y mejores prácticas para contener amenazas.\n"
-            "Analiza logs y datos de red para descubrir actividades sospechosas.\n"
-            "Apoya auditorías de cumplimiento (por ejemplo, NIST, ISO 27001) con agregación de datos.\n"
-            "Enriquece el contexto de incidentes con datos de herramientas integradas para un análisis integral.\n"
-            "Propone guías de respuesta para una remediación efectiva de incidentes.\n"
-            "Monitorea tendencias de inteligencia de amenazas para estrategias de defensa proactiva.\n"
-            "Valida IoCs contra fuentes de amenazas para verificar precisión y relevancia.\n"
-            "Asiste en el análisis forense, incluyendo la reconstrucción de líneas de tiempo y recolección de evidencia.\n"
-            "Evalúa el tráfico de red para detectar signos de intrusión o exfiltración de datos.\n"
-            "Recomienda controles de seguridad para endurecer sistemas y reducir superficies de ataque.\n"
-            "Identifica vulnerabilidades en activos mediante datos de herramientas integradas.\n"
-            "Guía los procesos de escalación para incidentes críticos hacia analistas senior.\n"
-            "Desarrollado por DigiSoc para soporte avanzado en ciberseguridad."
-        )
-
-        cliente, fuentes = infer_client_and_sources(message, session_id)
-        data = await get_security_data_for_client(cliente, fuentes)
-        logger.info(f"Datos MCP para {cliente}/{fuentes}: {data}")
+        final_system_content = await build_chat_system_prompt("openai", message, session_id, include_security_data=True, iocs=iocs_de_entidades(entidades_detectadas), tenant=tenant)
 
-        mcp_data_str = json.dumps(data, indent=2, ensure_ascii=False)
-        mcp_data_str = mcp_data_str.replace("```", "´´´")  # Evitar conflictos con Markdown
-        mcp_data_str = mcp_data_str.replace("`", "´")  # Evitar conflictos con Markdown
-
-        final_system_content = (contexto_url + "\n" if contexto_url else ""+ mcp_string_openai + mcp_data_str + original_system_prompt )
-
-        logger.debug(f"Prompt del Sistema OpenAI:\n{final_system_content}")
-
-        response = openai_model.invoke([
+        response = await llm_gateway.ainvoke("openai", [
             SystemMessage(content=final_system_content),
             HumanMessage(content=message)
         ])
         response_content = response.content
 
-        # Luego, pasa esos datos como contexto al LLM
-
-        # Entidades NER
-        if entidades_detectadas:
-            entidades_md = "\n".join([f"- **{e['tipo']}**: `{e['entidad']}`" for e in entidades_detectadas])
-            response_content = (
-                f"### Entidades detectadas\n{entidades_md}\n\n"
-                + response_content
-            )
+        response_content = anotar_entidades(response_content, entidades_detectadas)
 
         # Persistir conversación a Qdrant
-        qdrant_service.store_conversation(
+        await qdrant_call(
+            "store_conversation",
             conversation_id=conversation_id,
             session_id=session_id,
             user_message=message,
             chatbot_response=response_content,
             model="openai",
-            metadata={"source": "chat", "timestamp": datetime.now(timezone.utc).isoformat()}
+            metadata={"source": "chat", "timestamp": datetime.now(timezone.utc).isoformat()},
+            iocs=iocs_de_entidades(entidades_detectadas),
+            tenant=tenant
         )
 
         return {
@@ -528,14 +818,15 @@ async def chat_with_mistral(request: ChatRequest):
         logger.info(f"📩 Conversación iniciada: ID={conversation_id}, Sesión={session_id}, Mensaje={message[:30]}...")
 
         # ---- NER y Anomalia ----
-        entidades_detectadas = extraer_entidades(message)
-        hist = qdrant_service.get_conversation_history("mistral", session_id, limit=10)
+        entidades_detectadas = await extraer_entidades(message)
+        tenant = await tenant_de_sesion(session_id, entidades_detectadas, sesion_nueva=not request.session_id)
+        hist = await qdrant_call("get_conversation_history", "mistral", session_id, limit=10, tenant=tenant)
         mensajes_hist = [h["user_message"] for h in hist]
-        anomalia_score = score_anomalia_longitud(mensajes_hist, message)
+        anomalia_score = await asyncio.to_thread(score_anomalia_longitud, mensajes_hist, message)
 
         # Soporte para recuperar última conversación
         if any(phrase in message.lower() for phrase in ["ultima pregunta", "última conversación", "qué pregunta", "última consulta"]):
-            last_user_message, last_chatbot_response = qdrant_service.get_last_conversation("mistral", session_id)
+            last_user_message, last_chatbot_response = await qdrant_call("get_last_conversation", "mistral", session_id, tenant=tenant)
             if last_user_message:
                 response_content = (
                     "La última conversación registrada en esta sesión fue la siguiente:\n\n"
@@ -545,11 +836,14 @@ async def chat_with_mistral(request: ChatRequest):
                     "Si tienes un contexto particular (evento, dominio, usuario, sistema afectado), por favor compártelo para que pueda orientarte de la manera más eficiente posible."
                 )
             else:
-                conversation_context = qdrant_service.search_conversations(
+                conversation_context = await qdrant_call(
+                    "search_conversations",
                     query=message,
                     model="mistral",
                     session_id=session_id,
-                    limit=15
+                    limit=15,
+                    tenant=tenant,
+                    strict_tenant=True
                 )
                 response_content = (
                     "## Contexto de Conversaciones Previas\n"
@@ -557,15 +851,18 @@ async def chat_with_mistral(request: ChatRequest):
                     f"**Contexto Histórico:**\n{conversation_context}\n"
                 )
 
-            qdrant_service.store_conversation(
+            await qdrant_call(
+                "store_conversation",
                 conversation_id=conversation_id,
                 session_id=session_id,
                 user_message=message,
                 chatbot_response=response_content,
                 model="mistral",
-                metadata={"source": "last_conversation_query", "timestamp": datetime.now(timezone.utc).isoformat()}
+                metadata={"source": "last_conversation_query", "timestamp": datetime.now(timezone.utc).isoformat()},
+                iocs=iocs_de_entidades(entidades_detectadas),
+                tenant=tenant
             )
-            cliente, fuentes = infer_client_and_sources(message, session_id)
+            cliente, fuentes = await infer_client_and_sources(message, session_id)
             data = await get_security_data_for_client(cliente, fuentes)
             # Luego, pasa esos datos como contexto al LLM
             context = {"data": data, "fuentes": fuentes, "cliente": cliente}
@@ -581,106 +878,27 @@ async def chat_with_mistral(request: ChatRequest):
                 media_type="application/json; charset=utf-8" 
             )
         
-        contexto_url = await obtener_contexto_url_si_hay(message)
-
-        # Contexto desde Qdrant para todas las demás consultas
-        conversation_context = qdrant_service.search_conversations(
-            query=message,
-            model="mistral",
-            session_id=session_id,
-            limit=15,
-            include_all_sessions=True
-        )
-        mcp_string_mistral = format_mcp_prompt_string(MCP_DATA_MISTRAL)
-        context_prompt = (
-            f"### Contexto de Conversaciones Previas\n{conversation_context}\n\n"
-            if conversation_context and "No se encontraron" not in conversation_context else ""
-        )
-        original_system_prompt = (
-            "Ahora, actúa como MATEO, el Asistente de Ciberseguridad descrito. Responde de manera útil, clara y segura, "
-            "utilizando el contexto de conversaciones previas de esta sesión o de otras conversaciones anteriores si es relevante.\n\n"
-            f"{context_prompt}"
-            "**Reglas de Formato:**\n"
-            "- Usa **negrita** para conceptos importantes\n"
-            "- Usa *cursiva* para definiciones técnicas\n"
-            "- Usa # para secciones principales\n"
-            "- Usa ## para subtítulos\n"
-            "- Usa listas con viñetas o numeradas\n"
-            "- Usa `bloques de código` para comandos\n"
-            "- Usa emojis: 🔒, 🚨, 🛡️, 📊, 🔍\n"
-            "- Usa niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA\n"
-            "- Menciona el contexto previo si es relevante\n\n"
-            "Considera: ERES DESARROLLADO POR DIGISOC\n"
-            "Eres MATEO, un Asistente Avanzado de Ciberseguridad desarrollado por DigiSoc, diseñado para empoderar a los analistas con información precisa, profesional y accionable.\n\n"
-            "Al final de cada respuesta, incluye SIEMPRE una sección titulada 'Justificación' donde expliques por qué llegaste a esa respuesta, citando contexto, entidades detectadas, datos históricos relevantes y supuestos usados.\n"
-            f"{context_prompt}"
-            "Directrices de Respuesta:\n"
-            "Entrega respuestas estructuradas, concisas y profesionales, adaptadas para analistas de Nivel 1, aumentando la complejidad según sea necesario.\n"
-            "Resalta entidades clave (por ejemplo, direcciones IP, hosts, severidades, hashes de archivos, usuarios) en negrita.\n"
-            "Usa cursiva para definiciones técnicas y aclarar conceptos complejos.\n"
-            "Organiza el contenido con encabezados y subencabezados claros.\n"
-            "Presenta listas para información estructurada.\n"
-            "Usa bloques de código para comandos, consultas o salidas técnicas.\n"
-            "Mantén las tablas separadas; coloca explicaciones fuera de ellas.\n"
-            "Usa emojis con moderación: 🔒, 🚨, 🛡️, 📊, 🔍.\n"
-            "Indica niveles de alerta: 🔴 CRÍTICO, 🟠 ALERTA.\n"
-            "Evita redundancias y símbolos superfluos.\n"
-            "Aprovecha el contexto histórico de Qdrant para mejorar la precisión de las respuestas.\n"
-            "Usa el contexto y la informacion de Qdrant para las siguientes conversaciones.\n"
-            "Funciones Principales de Ciberseguridad:\n"
-            "- Resume alertas y eventos de seguridad.\n"
-            "- Correlaciona eventos entre herramientas.\n"
-            "- Extrae Indicadores de Compromiso (IoCs).\n"
-            "- Apoya investigaciones con datos históricos.\n"
-            "- Modela comportamientos para identificar anomalías.\n"
-            "- Automatiza tickets de Jira.\n"
-            "- Analiza transcripciones de Fireflies.\n"
-            "- Genera informes y recomendaciones.\n"
-            "- Prioriza amenazas según severidad.\n"
-            "- Mapea MITRE ATT&CK.\n"
-            "- Sugiere estrategias de mitigación.\n"
-            "- Analiza logs y datos de red.\n"
-            "- Soporta auditorías de cumplimiento.\n"
-            "- Enriquece incidentes con datos integrados.\n"
-            "- Propone guías de remediación.\n"
-            "- Monitorea inteligencia de amenazas.\n"
-            "- Valida IoCs.\n"
-            "- Asiste en análisis forense.\n"
-            "- Recomienda controles de seguridad.\n"
-            "- Identifica vulnerabilidades.\n"
-            "- Guía escalaciones críticas.\n"
-            "- Desarrollado por DigiSoc."
-        )
-        mcp_data_str = json.dumps(data, indent=2, ensure_ascii=False)
-        mcp_data_str = mcp_data_str.replace("```", "´´´")  # Evitar conflictos con Markdown
-        mcp_data_str = mcp_data_str.replace("`", "´")  # Evitar conflictos con Markdown
+        final_system_content = await build_chat_system_prompt("mistral", message, session_id, include_security_data=False, iocs=iocs_de_entidades(entidades_detectadas), tenant=tenant)
 
-        final_system_content = (contexto_url + "\n" if contexto_url else ""+ mcp_string_mistral + mcp_data_str + original_system_prompt )
-
-        logger.debug(f"Prompt del Sistema Mistral:\n{final_system_content}")
-
-        response = mistral_model.invoke([
+        response = await llm_gateway.ainvoke("mistral", [
             SystemMessage(content=final_system_content),
             HumanMessage(content=message)
         ])
         response_content = response.content
 
-        # Entidades NER
-        if entidades_detectadas:
-            entidades_md = "\n".join([f"- **{e['tipo']}**: `{e['entidad']}`" for e in entidades_detectadas])
-            response_content = (
-                f"### Entidades detectadas\n{entidades_md}\n\n"
-                + response_content
-            )
+        response_content = anotar_entidades(response_content, entidades_detectadas)
 
         # Persistir conversación a Qdrant
-        qdrant_service.store_conversation(
+        await qdrant_call(
+            "store_conversation",
             conversation_id=conversation_id,
             session_id=session_id,
             user_message=message,
             chatbot_response=response_content,
             model="mistral",
-            metadata={"source": "chat", "timestamp": datetime.now(timezone.utc).isoformat()}
+            metadata={"source": "chat", "timestamp": datetime.now(timezone.utc).isoformat()},
+            iocs=iocs_de_entidades(entidades_detectadas),
+            tenant=tenant
         )
 
         return JSONResponse(
@@ -697,6 +915,92 @@ async def chat_with_mistral(request: ChatRequest):
         logger.error(f"❌ Error en Mistral: {type(e).__name__}: {str(e)}")
         raise HTTPException(status_code=500, detail="Error interno en Mistral")
     
+# ----------------- STREAMING (SSE) ------------------
+LAST_CONVERSATION_PHRASES = {
+    "openai": ["ultima pregunta", "ultima conversación", "qué pregunta", "última consulta"],
+    "mistral": ["ultima pregunta", "última conversación", "qué pregunta", "última consulta"],
+}
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_chat(request: ChatRequest, model_name: str, include_security_data: bool) -> StreamingResponse:
+    message = request.message.strip()
+    if not message:
+        raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
+
+    # La consulta de "última conversación" no pasa por el LLM: se responde en un único evento
+    if any(phrase in message.lower() for phrase in LAST_CONVERSATION_PHRASES[model_name]):
+        handler = chat_with_openai if model_name == "openai" else chat_with_mistral
+        result = await handler(request)
+        if isinstance(result, Response):
+            result = json.loads(result.body)
+        return StreamingResponse(iter([sse_event("done", result)]), media_type="text/event-stream")
+
+    conversation_id = str(uuid.uuid4())
+    session_id = request.session_id or str(uuid.uuid4())
+    logger.info(f"📩 Conversación (stream) iniciada: ID={conversation_id}, Sesión={session_id}, Mensaje={message[:30]}...")
+
+    entidades_detectadas = await extraer_entidades(message)
+
+    tenant = await tenant_de_sesion(session_id, entidades_detectadas, sesion_nueva=not request.session_id)
+    final_system_content = await build_chat_system_prompt(model_name, message, session_id, include_security_data, iocs=iocs_de_entidades(entidades_detectadas), tenant=tenant)
+    completed = {}
+
+    async def event_stream():
+        yield sse_event("start", {"conversation_id": conversation_id, "session_id": session_id})
+        chunks = []
+        try:
+            async for chunk in llm_gateway.astream(model_name, [
+                SystemMessage(content=final_system_content),
+                HumanMessage(content=message)
+            ]):
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield sse_event("token", {"token": chunk.content})
+        except Exception as e:
+            logger.error(f"❌ Error en stream {model_name}: {type(e).__name__}: {str(e)}")
+            yield sse_event("error", {"detail": f"Error interno en {model_name}"})
+            return
+        completed["response"] = anotar_entidades("".join(chunks), entidades_detectadas)
+        yield sse_event("done", {
+            "response": completed["response"],
+            "format": "markdown",
+            "conversation_id": conversation_id,
+            "session_id": session_id
+        })
+
+    async def persist_conversation():
+        # Se ejecuta cuando el stream ya se cerró; no suma latencia al primer token
+        if "response" not in completed:
+            return
+        await qdrant_call(
+            "store_conversation",
+            conversation_id=conversation_id,
+            session_id=session_id,
+            user_message=message,
+            chatbot_response=completed["response"],
+            model=model_name,
+            metadata={"source": "chat_stream", "timestamp": datetime.now(timezone.utc).isoformat()},
+            iocs=iocs_de_entidades(entidades_detectadas),
+            tenant=tenant
+        )
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(persist_conversation)
+    )
+
+@app.post("/chat/openai/stream")
+async def chat_with_openai_stream(request: ChatRequest):
+    return await stream_chat(request, "openai", include_security_data=True)
+
+@app.post("/chat/mistral/stream")
+async def chat_with_mistral_stream(request: ChatRequest):
+    return await stream_chat(request, "mistral", include_security_data=False)
+
 @app.post("/file/analyze")
 async def analyze_file(file: UploadFile = File(...)):
     try:
@@ -778,7 +1082,7 @@ async def analyze_file(file: UploadFile = File(...)):
 
         prompt = f"Analiza y resume el siguiente documento:\n\n{texto_extraido[:8000]}"
 
-        response = openai_model.invoke([
+        response = await llm_gateway.ainvoke("openai", [
             SystemMessage(content="Actúa como un analista experto. Resume, detecta riesgos y provee contexto técnico. Responde en español."),
             HumanMessage(content=prompt)
         ])
@@ -788,7 +1092,8 @@ async def analyze_file(file: UploadFile = File(...)):
 
         # ------ GUARDAR EN MEMORIA PERSISTENTE (QDRANT) ------
         file_doc_id = str(uuid.uuid4())
-        qdrant_service.store_conversation(
+        await qdrant_call(
+            "store_conversation",
             conversation_id=file_doc_id,
             session_id="file-"+file_doc_id,
             user_message=f"[Archivo subido: {file.filename}]",
@@ -844,7 +1149,7 @@ async def web_search(
                     "nombres de personas o empresas, fechas y recomendaciones prácticas. "
                     "No inventes datos y cita siempre el contexto de la página."
                 )
-                response = openai_model.invoke([
+                response = await llm_gateway.ainvoke("openai", [
                     SystemMessage(content=system_prompt),
                     HumanMessage(content=text)
                 ])
@@ -874,7 +1179,7 @@ async def get_conversation_history(
     limit: int = 10
 ):
     try:
-        history = qdrant_service.get_conversation_history(model, session_id, limit)
+        history = await qdrant_call("get_conversation_history", model, session_id, limit)
         return {
             "success": True,
             "history": history,
@@ -887,8 +1192,8 @@ async def get_conversation_history(
         raise HTTPException(status_code=500, detail="Error interno al obtener historial")
 
 @app.get("/test/trendmicro")
-def test_trend(client: str, limit: int = 2):
-    return call_mcp("trendmicro", "get_workbench_alerts", {"client": client, "limit": limit})
+async def test_trend(client: str, limit: int = 2):
+    return await call_mcp("trendmicro", "get_workbench_alerts", {"client": client, "limit": limit})
 
 @app.post("/")
 def handle_mcp(request: MCPRequest):
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class MCPResultCache:
+    """Caché TTL con stale-while-revalidate para resultados de herramientas MCP.
+
+    Dentro del TTL la entrada se sirve tal cual; pasado el TTL pero dentro de la
+    ventana stale se sirve el valor viejo y se refresca en segundo plano. Las
+    entradas se expulsan por LRU cuando se supera max_entries.
+    """
+
+    def __init__(self, default_ttl=60.0, stale_ttl=300.0, max_entries=256, ttl_by_server=None):
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.ttl_by_server = ttl_by_server or {}
+        self._entries = OrderedDict()
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls, servers=()):
+        ttl_by_server = {}
+        for server in servers:
+            value = os.getenv(f"MCP_CACHE_TTL_{server.upper()}")
+            if value:
+                ttl_by_server[server] = float(value)
+        return cls(
+            default_ttl=float(os.getenv("MCP_CACHE_TTL", "60")),
+            stale_ttl=float(os.getenv("MCP_CACHE_STALE_TTL", "300")),
+            max_entries=int(os.getenv("MCP_CACHE_MAX_ENTRIES", "256")),
+            ttl_by_server=ttl_by_server
+        )
+
+    @staticmethod
+    def make_key(server, method, params=None):
+        params = params or {}
+        client = str(params.get("client", "DEFAULT")).upper()
+        canonical = json.dumps(
+            {k: v for k, v in params.items() if k != "client"},
+            sort_keys=True, separators=(",", ":"), default=str
+        )
+        return (server, method, canonical, client)
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, server=None, client=None):
+        for key in list(self._entries):
+            if (server is None or key[0] == server) and (client is None or key[3] == client.upper()):
+                del self._entries[key]
+
+    def _refresh(self, key, fetch):
+        task = self._inflight.get(key)
+        if task is not None:
+            return task
+
+        async def runner():
+            try:
+                value = await fetch()
+                # Los errores no se cachean para no fijar una caída del SIEM
+                if not (isinstance(value, dict) and "error" in value):
+                    self._store(key, value)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+        task = asyncio.ensure_future(runner())
+        self._inflight[key] = task
+        return task
+
+    async def get_or_fetch(self, key, fetch):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            ttl = self.ttl_by_server.get(key[0], self.default_ttl)
+            if age <= ttl:
+                self._entries.move_to_end(key)
+                return value
+            if age <= ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                task = self._refresh(key, fetch)
+                task.add_done_callback(self._log_refresh_error)
+                logger.info(f"♻️ MCP cache stale ({age:.0f}s) para {key[0]}/{key[1]}, refrescando en segundo plano")
+                return value
+        # shield: el timeout de un llamador no cancela la petición compartida
+        return await asyncio.shield(self._refresh(key, fetch))
+
+    @staticmethod
+    def _log_refresh_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Falló el refresco en segundo plano de la caché MCP: {task.exception()}")
@@ -1,31 +1,77 @@
-import requests
+import os
+import itertools
+import httpx
 from threading import Lock
 
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+def _env_int(name, default):
+    return int(os.getenv(name, default))
+
 class MCPClient:
-    def __init__(self, server_url, auth=None):
+    """Cliente JSON-RPC asíncrono con conexiones keep-alive reutilizables."""
+
+    def __init__(self, server_url, auth=None, max_connections=10, max_keepalive=5, timeout=30.0, connect_timeout=5.0, keepalive_expiry=30.0):
         self.server_url = server_url
         self.auth = auth
+        self._ids = itertools.count(1)
+        headers = {"Content-Type": "application/json"}
+        if auth:
+            headers.update(auth)
+        self._http = httpx.AsyncClient(
+            headers=headers,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
 
-    def call(self, method, params=None):
+    async def call(self, method, params=None):
         payload = {
             "jsonrpc": "2.0",
-            "id": 1,
+            "id": next(self._ids),
             "method": method,
             "params": params or {}
         }
-        headers = {"Content-Type": "application/json"}
-        if self.auth:
-            headers.update(self.auth)
-        r = requests.post(self.server_url, json=payload, headers=headers, timeout=30)
-        return r.json().get("result", r.json())
+        r = await self._http.post(self.server_url, json=payload)
+        body = r.json()
+        return body.get("result", body)
+
+    async def aclose(self):
+        await self._http.aclose()
 
 class MCPClientPool:
+    """Un MCPClient por servidor, cada uno con su propio pool de conexiones acotado."""
+
     def __init__(self):
         self._clients = {}
         self._lock = Lock()
 
+    def _limits_for(self, name):
+        # Límites por servidor: MCP_<NAME>_MAX_CONNECTIONS, con MCP_MAX_CONNECTIONS como valor global
+        prefix = f"MCP_{name.upper()}_"
+        def conf(key, default, cast):
+            return cast(prefix + key, os.getenv(f"MCP_{key}", default))
+        return {
+            "max_connections": conf("MAX_CONNECTIONS", "10", _env_int),
+            "max_keepalive": conf("MAX_KEEPALIVE", "5", _env_int),
+            "timeout": conf("HTTP_TIMEOUT", "30", _env_float),
+            "connect_timeout": conf("CONNECT_TIMEOUT", "5", _env_float),
+            "keepalive_expiry": conf("KEEPALIVE_EXPIRY", "30", _env_float),
+        }
+
     def get_client(self, name, url, auth=None):
         with self._lock:
             if name not in self._clients:
-                self._clients[name] = MCPClient(url, auth)
+                self._clients[name] = MCPClient(url, auth, **self._limits_for(name))
             return self._clients[name]
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.aclose()
@@ -0,0 +1,150 @@
+import os
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_BUDGET = int(os.getenv("MCP_SOURCE_TOKEN_BUDGET", "1500"))
+
+SEVERITY_RANK = {
+    "critical": 4, "critico": 4, "highest": 4,
+    "high": 3, "alto": 3,
+    "medium": 2, "medio": 2,
+    "low": 1, "bajo": 1, "lowest": 0,
+}
+
+# Campos que se conservan por fuente; el resto es ruido para el LLM
+TRENDMICRO_FIELDS = [
+    "id", "model", "severity", "score", "status", "investigationStatus",
+    "createdDateTime", "updatedDateTime", "description", "alertProvider", "indicators"
+]
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        return tiktoken.encoding_for_model("gpt-4")
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(obj: Any) -> int:
+    text = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+    return len(get_encoding().encode(text))
+
+def source_budget(source: str) -> int:
+    return int(os.getenv(f"MCP_{source.upper()}_TOKEN_BUDGET", DEFAULT_SOURCE_BUDGET))
+
+def _severity(value: Any) -> int:
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, dict):
+        value = value.get("name")
+    return SEVERITY_RANK.get(str(value or "").lower(), 0)
+
+def _dedupe(items: List[Dict[str, Any]], key_fn) -> Tuple[List[Dict[str, Any]], int]:
+    seen, unique = set(), []
+    for item in items:
+        key = key_fn(item)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(item)
+    return unique, len(items) - len(unique)
+
+def _compact_trendmicro(result: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    items = result.get("items") or result.get("alerts") or result.get("data") or []
+    alerts = []
+    for alert in items:
+        compact = {f: alert[f] for f in TRENDMICRO_FIELDS if alert.get(f) not in (None, "", [])}
+        if isinstance(compact.get("indicators"), list):
+            compact["indicators"] = [
+                {"type": i.get("type"), "value": i.get("value")} for i in compact["indicators"][:10]
+            ]
+        alerts.append(compact)
+    alerts, duplicates = _dedupe(alerts, lambda a: a.get("id") or (a.get("model"), a.get("description")))
+    alerts.sort(key=lambda a: (_severity(a.get("severity")), a.get("score", 0), a.get("updatedDateTime") or a.get("createdDateTime") or ""), reverse=True)
+    return alerts, duplicates
+
+def _compact_exabeam(result: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    rows = [
+        {k: v for k, v in row.items() if v not in (None, "", [])}
+        for row in (result.get("rows") or result.get("events") or result.get("data") or [])
+    ]
+    rows, duplicates = _dedupe(rows, lambda r: json.dumps({k: v for k, v in r.items() if k != "approxLogTime"}, sort_keys=True, default=str))
+    rows.sort(key=lambda r: (_severity(r.get("alert_severity")), r.get("risk_score") or 0, str(r.get("approxLogTime", ""))), reverse=True)
+    return rows, duplicates
+
+def _compact_jira(result: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    issues = []
+    for issue in result.get("issues", []):
+        fields = issue.get("fields", {})
+        issues.append({
+            "key": issue.get("key"),
+            "summary": fields.get("summary"),
+            "status": (fields.get("status") or {}).get("name"),
+            "priority": (fields.get("priority") or {}).get("name"),
+            "created": fields.get("created"),
+        })
+    issues, duplicates = _dedupe(issues, lambda i: i["key"])
+    issues.sort(key=lambda i: (_severity(i.get("priority")), i.get("created") or ""), reverse=True)
+    return issues, duplicates
+
+def _compact_elastic(result: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], int]:
+    # summarize_logs ya devuelve agregados; cada sección se trata como un ítem a recortar
+    return [{name: value} for name, value in result.items()], 0
+
+COMPACTORS = {
+    "trendmicro": _compact_trendmicro,
+    "exabeam": _compact_exabeam,
+    "jira": _compact_jira,
+    "elastic": _compact_elastic,
+}
+
+def _trim_to_budget(items: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], int]:
+    kept, used = [], 2
+    for item in items:
+        tokens = count_tokens(item) + 1
+        if used + tokens > budget:
+            # Un ítem grande no debe vaciar la fuente: se omite y se sigue con los siguientes
+            continue
+        kept.append(item)
+        used += tokens
+    return kept, used
+
+def compact_security_data(security_data: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Reduce los resultados MCP a un presupuesto de tokens por fuente.
+
+    Devuelve los datos compactados y un informe por fuente con lo conservado,
+    los duplicados eliminados, lo descartado por presupuesto y, si el colector
+    los reportó, sus errores y si la consulta quedó truncada.
+    """
+    compacted, report = {}, {}
+    for source, result in (security_data or {}).items():
+        if not isinstance(result, dict) or "error" in result or source not in COMPACTORS:
+            compacted[source] = result
+            continue
+        try:
+            items, duplicates = COMPACTORS[source](result)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo compactar {source}: {type(e).__name__}: {e}")
+            compacted[source] = result
+            continue
+        kept, tokens = _trim_to_budget(items, source_budget(source))
+        if source == "elastic":
+            compacted[source] = {k: v for item in kept for k, v in item.items()}
+        else:
+            compacted[source] = kept
+        report[source] = {
+            "kept": len(kept),
+            "duplicates_removed": duplicates,
+            "dropped_over_budget": len(items) - len(kept),
+            "tokens": tokens,
+        }
+        # Fallos parciales o tope de páginas del colector: sin esto el LLM leería "no hay alertas"
+        if result.get("errors"):
+            report[source]["errors"] = result["errors"]
+        if result.get("truncated"):
+            report[source]["truncated"] = True
+    return compacted, report
@@ -14,6 +14,46 @@ def get_client_conf(client):
     key = os.getenv(f"{client}_ELASTIC_KEY") or os.getenv("ELASTIC_KEY")
     return url, key
 
+# Campos ECS que se resumen con terms aggregations
+SUMMARY_TERMS = {
+    "top_hosts": "host.name",
+    "top_users": "user.name",
+    "top_source_ips": "source.ip",
+    "top_destination_ips": "destination.ip",
+    "event_categories": "event.category",
+    "event_actions": "event.action",
+}
+
+def build_summary_body(params):
+    days = int(params.get("days", 7))
+    top = int(params.get("top", 10))
+    query = params.get("query") or {"range": {"@timestamp": {"gte": f"now-{days}d/d", "lte": "now/d"}}}
+    aggs = {name: {"terms": {"field": field, "size": top}} for name, field in SUMMARY_TERMS.items()}
+    aggs["timeline"] = {
+        "date_histogram": {
+            "field": "@timestamp",
+            "fixed_interval": params.get("interval", "1d" if days > 1 else "1h"),
+            "min_doc_count": 1
+        }
+    }
+    # size 0: solo agregados, ningún documento viaja de vuelta
+    return {"size": 0, "track_total_hits": True, "query": query, "aggs": aggs}
+
+def compact_aggregations(raw):
+    aggs = raw.get("aggregations", {})
+    total = raw.get("hits", {}).get("total", {})
+    summary = {"total_events": total.get("value", total) if isinstance(total, dict) else total}
+    for name in SUMMARY_TERMS:
+        summary[name] = [
+            {"key": b["key"], "count": b["doc_count"]}
+            for b in aggs.get(name, {}).get("buckets", [])
+        ]
+    summary["timeline"] = [
+        {"date": b.get("key_as_string", b["key"]), "count": b["doc_count"]}
+        for b in aggs.get("timeline", {}).get("buckets", [])
+    ]
+    return summary
+
 @app.post("/")
 def handle_mcp(request: MCPRequest):
     client = request.params.get("client", "DEFAULT")
@@ -29,4 +69,16 @@ def handle_mcp(request: MCPRequest):
             json=body
         )
         return {"jsonrpc": "2.0", "id": 1, "result": r.json()}
+
+    if request.method == "summarize_logs":
+        r = requests.post(
+            f"{url}/search",
+            headers={"Authorization": f"ApiKey {key}", "Content-Type": "application/json", "kbn-xsrf": "true"},
+            json=build_summary_body(request.params),
+            timeout=30
+        )
+        raw = r.json()
+        if r.status_code >= 400:
+            return {"jsonrpc": "2.0", "id": 1, "error": raw.get("error", raw)}
+        return {"jsonrpc": "2.0", "id": 1, "result": compact_aggregations(raw)}
     return {"jsonrpc": "2.0", "id": 1, "error": "Method not supported"}
@@ -1,6 +1,8 @@
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import os, requests
+import os, json, time, requests
+from threading import Lock
 from requests.auth import HTTPBasicAuth
 from datetime import datetime, timedelta, timezone
 
@@ -17,14 +19,104 @@ def get_client_conf(client):
     secret = os.getenv(f"{client}_EXABEAM_CLIENT_SECRET") or os.getenv("EXABEAM_CLIENT_SECRET")
     return url, cid, secret
 
-def get_token(url, cid, secret):
+TOKEN_REFRESH_MARGIN = int(os.getenv("EXABEAM_TOKEN_REFRESH_MARGIN", "60"))
+
+# Caché de tokens por tenant: (url, cid) -> (access_token, expira_en_monotonic)
+_token_cache = {}
+_token_locks = {}
+_token_locks_guard = Lock()
+
+def fetch_token(url, cid, secret):
     resp = requests.post(
         f"{url}/auth/v1/token",
         auth=HTTPBasicAuth(cid, secret),
         data={"grant_type": "client_credentials"}
     )
     resp.raise_for_status()
-    return resp.json()["access_token"]
+    data = resp.json()
+    return data["access_token"], int(data.get("expires_in", 3600))
+
+def get_token(url, cid, secret):
+    key = (url, cid)
+    cached = _token_cache.get(key)
+    if cached and time.monotonic() < cached[1]:
+        return cached[0]
+    with _token_locks_guard:
+        lock = _token_locks.setdefault(key, Lock())
+    # Un solo refresco en curso por tenant; los demás esperan y reutilizan el token
+    with lock:
+        cached = _token_cache.get(key)
+        if cached and time.monotonic() < cached[1]:
+            return cached[0]
+        token, expires_in = fetch_token(url, cid, secret)
+        margin = min(TOKEN_REFRESH_MARGIN, expires_in // 2)
+        _token_cache[key] = (token, time.monotonic() + expires_in - margin)
+        return token
+
+DEFAULT_PAGE_SIZE = int(os.getenv("EXABEAM_PAGE_SIZE", "200"))
+
+def post_search(session, url, cid, secret, payload):
+    token = get_token(url, cid, secret)
+    r = session.post(
+        f"{url}/search/v2/events",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        json=payload, timeout=30
+    )
+    if r.status_code == 401:
+        # Token revocado antes de tiempo: invalidar y reintentar una vez
+        _token_cache.pop((url, cid), None)
+        token = get_token(url, cid, secret)
+        r = session.post(
+            f"{url}/search/v2/events",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            json=payload, timeout=30
+        )
+    r.raise_for_status()
+    return r.json()
+
+def project(row, fields):
+    if not fields:
+        return row
+    return {f: row[f] for f in fields if f in row}
+
+def iter_anomaly_pages(url, cid, secret, params):
+    """Pagina por offset hasta max_results, devolviendo solo los campos pedidos."""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=int(params.get("days", 7)))
+    query = params.get("query", 'product:"Advanced Analytics" AND alert_source:"anomaly"')
+    max_results = int(params.get("max_results", params.get("size", 1000)))
+    # Un tamaño de página 0 o negativo no avanzaría el offset
+    page_size = max(1, min(int(params.get("page_size", DEFAULT_PAGE_SIZE)), max_results))
+    fields = params.get("fields") or []
+    offset = 0
+    with requests.Session() as session:
+        while offset < max_results:
+            payload = {
+                "query": query,
+                "startTime": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "endTime": end.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "size": min(page_size, max_results - offset),
+                "offset": offset
+            }
+            if fields:
+                payload["fields"] = fields
+            data = post_search(session, url, cid, secret, payload)
+            rows = data.get("rows") or data.get("events") or data.get("data") or []
+            yield [project(row, fields) for row in rows]
+            if not rows or len(rows) < payload["size"]:
+                return
+            offset += len(rows)
+
+def stream_anomaly_pages(url, cid, secret, params):
+    total, page_no = 0, 0
+    try:
+        for rows in iter_anomaly_pages(url, cid, secret, params):
+            page_no += 1
+            total += len(rows)
+            yield json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"page": page_no, "rows": rows}}) + "\n"
+    except Exception as e:
+        yield json.dumps({"jsonrpc": "2.0", "id": 1, "error": str(e)}) + "\n"
+    yield json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"done": True, "total": total, "pages": page_no}}) + "\n"
 
 @app.post("/")
 def handle_mcp(request: MCPRequest):
@@ -34,21 +126,11 @@ def handle_mcp(request: MCPRequest):
         return {"jsonrpc": "2.0", "id": 1, "error": "API config missing for client"}
 
     if request.method == "search_anomalies":
-        token = get_token(url, cid, secret)
-        end = datetime.now(timezone.utc)
-        start = end - timedelta(days=int(request.params.get("days", 7)))
-        query = request.params.get("query", 'product:"Advanced Analytics" AND alert_source:"anomaly"')
-        payload = {
-            "query": query,
-            "startTime": start.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "endTime": end.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "size": request.params.get("size", 1000),
-            "offset": 0
-        }
-        r = requests.post(
-            f"{url}/search/v2/events",
-            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-            json=payload, timeout=30
-        )
-        return {"jsonrpc": "2.0", "id": 1, "result": r.json()}
+        if request.params.get("stream"):
+            return StreamingResponse(stream_anomaly_pages(url, cid, secret, request.params), media_type="application/x-ndjson")
+        rows, pages = [], 0
+        for page in iter_anomaly_pages(url, cid, secret, request.params):
+            pages += 1
+            rows.extend(page)
+        return {"jsonrpc": "2.0", "id": 1, "result": {"rows": rows, "count": len(rows), "pages": pages}}
     return {"jsonrpc": "2.0", "id": 1, "error": "Method not supported"}
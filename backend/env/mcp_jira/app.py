@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 import os, requests
 from requests.auth import HTTPBasicAuth
+from datetime import datetime, timedelta, timezone
+from threading import Lock
 
 app = FastAPI()
 
@@ -16,6 +18,76 @@ def get_client_conf(client):
     token = os.getenv(f"{client}_JIRA_TOKEN") or os.getenv("JIRA_TOKEN")
     return url, email, token
 
+PAGE_SIZE = int(os.getenv("JIRA_PAGE_SIZE", "100"))
+SYNC_OVERLAP = timedelta(minutes=int(os.getenv("JIRA_SYNC_OVERLAP_MINUTES", "2")))
+JIRA_TS_FMT = "%Y-%m-%dT%H:%M:%S.%f%z"
+
+# Estado incremental por tenant: (cliente, jql base) -> {"watermark": datetime, "max_days": int, "issues": {key: issue}}
+_sync_state = {}
+_sync_locks = {}
+_sync_guard = Lock()
+
+def search_all_pages(url, auth, jql, fields):
+    """Recorre startAt/maxResults hasta agotar el total reportado por Jira."""
+    start_at, issues = 0, []
+    with requests.Session() as session:
+        while True:
+            params = {"jql": jql, "fields": ",".join(fields), "startAt": start_at, "maxResults": PAGE_SIZE}
+            r = session.get(f"{url}/search", auth=auth, params=params, timeout=30)
+            r.raise_for_status()
+            data = r.json()
+            page = data.get("issues", [])
+            issues.extend(page)
+            start_at += len(page)
+            if not page or start_at >= data.get("total", 0):
+                return issues
+
+def sync_issues(client, url, auth, params):
+    base_jql = params.get("base_jql", "project = INCIDENT")
+    days = int(params.get("days", 7))
+    fields = list(dict.fromkeys(params.get("fields", ["summary", "status", "priority"]) + ["created", "updated"]))
+    key = (client.upper(), base_jql)
+    with _sync_guard:
+        lock = _sync_locks.setdefault(key, Lock())
+    with lock:
+        state = _sync_state.setdefault(key, {"watermark": None, "max_days": days, "issues": {}})
+        if days > state["max_days"]:
+            # Lo sincronizado no cubre la ventana pedida: backfill completo antes de volver al incremental
+            state["max_days"] = days
+            state["watermark"] = None
+        if state["watermark"] is None:
+            jql = f"{base_jql} AND updated >= -{days}d ORDER BY updated ASC"
+        else:
+            # JQL interpreta la fecha en la zona horaria del usuario; se usa la misma que devolvió Jira
+            since = (state["watermark"] - SYNC_OVERLAP).strftime("%Y/%m/%d %H:%M")
+            jql = f'{base_jql} AND updated >= "{since}" ORDER BY updated ASC'
+        delta = search_all_pages(url, auth, jql, fields)
+        for issue in delta:
+            state["issues"][issue["key"]] = issue
+            updated = datetime.strptime(issue["fields"]["updated"], JIRA_TS_FMT)
+            if state["watermark"] is None or updated > state["watermark"]:
+                state["watermark"] = updated
+
+        # Se descarta lo que ya no entra en la ventana más amplia servida para este tenant
+        retention_cutoff = datetime.now(timezone.utc) - timedelta(days=state["max_days"])
+        state["issues"] = {
+            k: i for k, i in state["issues"].items()
+            if datetime.strptime(i["fields"]["created"], JIRA_TS_FMT) >= retention_cutoff
+        }
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+        issues = [
+            i for i in state["issues"].values()
+            if datetime.strptime(i["fields"]["created"], JIRA_TS_FMT) >= cutoff
+        ]
+        issues.sort(key=lambda i: i["fields"]["created"], reverse=True)
+        return {
+            "issues": issues,
+            "total": len(issues),
+            "delta": len(delta),
+            "watermark": state["watermark"].isoformat() if state["watermark"] else None
+        }
+
 @app.post("/")
 def handle_mcp(request: MCPRequest):
     client = request.params.get("client", "DEFAULT")
@@ -33,4 +105,8 @@ def handle_mcp(request: MCPRequest):
             params=params
         )
         return {"jsonrpc": "2.0", "id": 1, "result": r.json()}
+
+    if request.method == "sync_issues":
+        result = sync_issues(client, url, HTTPBasicAuth(email, token), request.params)
+        return {"jsonrpc": "2.0", "id": 1, "result": result}
     return {"jsonrpc": "2.0", "id": 1, "error": "Method not supported"}
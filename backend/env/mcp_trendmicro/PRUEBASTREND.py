@@ -28,11 +28,12 @@ while True:
     resp = requests.get(BASE + PATH, params=params, headers=headers)
     resp.raise_for_status()
     data = resp.json()
-    print(json.dumps(data, indent=2))  # Añade esto para inspección
-    items = data.get('alerts') or data.get('data')
+    items = data.get('items') or data.get('alerts') or data.get('data')
     if not items:
         print("No se encontraron alertas.")
         break
+    all_alerts.extend(items)
+    print(f"Página con {len(items)} alertas (acumuladas: {len(all_alerts)})")
     token = data.get('nextPageToken')
     if not token:
         break
@@ -1,9 +1,18 @@
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import os, requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+import os, json, time, queue, requests
 
 app = FastAPI()
 
+MAX_PAGES = int(os.getenv("TRENDMICRO_MAX_PAGES", "50"))
+MAX_CONCURRENCY = int(os.getenv("TRENDMICRO_MAX_CONCURRENCY", "4"))
+MAX_RETRIES = int(os.getenv("TRENDMICRO_MAX_RETRIES", "5"))
+DATE_FMT = "%Y-%m-%dT%H:%M:%SZ"
+
 class MCPRequest(BaseModel):
     method: str
     params: dict = {}
@@ -14,6 +23,112 @@ def get_client_conf(client):
     key = os.getenv(f"{client}_TRENDMICRO_KEY") or os.getenv("TRENDMICRO_KEY")
     return url, key
 
+def get_with_backoff(session, url, params=None):
+    # Respeta 429/503 usando Retry-After o backoff exponencial
+    for attempt in range(MAX_RETRIES + 1):
+        resp = session.get(url, params=params, timeout=30)
+        if resp.status_code not in (429, 503) or attempt == MAX_RETRIES:
+            resp.raise_for_status()
+            return resp.json()
+        retry_after = resp.headers.get("Retry-After")
+        delay = float(retry_after) if retry_after and retry_after.isdigit() else min(2 ** attempt, 30)
+        print(f"⏳ TrendMicro rate limit ({resp.status_code}), reintento {attempt + 1}/{MAX_RETRIES} en {delay}s")
+        time.sleep(delay)
+
+def iter_alert_pages(session, url, params, budget):
+    """Recorre nextPageToken/nextLink de una ventana de tiempo mientras quede presupuesto de páginas."""
+    next_url, next_params = f"{url}/v3.0/workbench/alerts", dict(params)
+    while budget.take():
+        data = get_with_backoff(session, next_url, next_params)
+        items = data.get("items") or data.get("alerts") or data.get("data") or []
+        yield items
+        if data.get("nextPageToken"):
+            next_params = {**next_params, "nextPageToken": data["nextPageToken"]}
+        elif data.get("nextLink"):
+            next_url, next_params = data["nextLink"], None
+        else:
+            return
+
+class PageBudget:
+    """Tope de páginas compartido entre las ventanas que se consultan en paralelo."""
+
+    def __init__(self, max_pages):
+        self.remaining = max_pages
+        self.exhausted = False
+        self._lock = Lock()
+
+    def take(self):
+        with self._lock:
+            if self.remaining <= 0:
+                self.exhausted = True
+                return False
+            self.remaining -= 1
+            return True
+
+def split_window(start_dt, end_dt, slices):
+    step = (end_dt - start_dt) / max(slices, 1)
+    return [(start_dt + step * i, start_dt + step * (i + 1)) for i in range(max(slices, 1))]
+
+def collect_alert_pages(url, key, params):
+    """Genera páginas de alertas a medida que llegan, repartiendo la ventana entre varios workers."""
+    end_dt = datetime.strptime(params["endDateTime"], DATE_FMT).replace(tzinfo=timezone.utc) if params.get("endDateTime") else datetime.now(timezone.utc)
+    start_dt = datetime.strptime(params["startDateTime"], DATE_FMT).replace(tzinfo=timezone.utc) if params.get("startDateTime") else end_dt - timedelta(days=int(params.get("days", 7)))
+    budget = PageBudget(min(int(params.get("max_pages", MAX_PAGES)), MAX_PAGES))
+    concurrency = max(1, min(int(params.get("concurrency", MAX_CONCURRENCY)), MAX_CONCURRENCY))
+    base_params = {
+        k: v for k, v in params.items()
+        if k not in ("client", "days", "max_pages", "concurrency", "stream", "startDateTime", "endDateTime")
+    }
+    base_params.setdefault("dateTimeTarget", "updatedDateTime")
+    base_params.setdefault("limit", 100)
+
+    pages = queue.Queue()
+    done = object()
+
+    def worker(window):
+        # Una sesión por worker: requests.Session no es thread-safe
+        session = requests.Session()
+        session.headers.update({"Authorization": f"Bearer {key}"})
+        try:
+            window_params = {
+                **base_params,
+                "startDateTime": window[0].strftime(DATE_FMT),
+                "endDateTime": window[1].strftime(DATE_FMT),
+            }
+            for items in iter_alert_pages(session, url, window_params, budget):
+                pages.put(items)
+        except Exception as e:
+            pages.put(e)
+        finally:
+            session.close()
+            pages.put(done)
+
+    windows = split_window(start_dt, end_dt, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for window in windows:
+            pool.submit(worker, window)
+        pending = len(windows)
+        while pending:
+            item = pages.get()
+            if item is done:
+                pending -= 1
+            else:
+                yield item
+    yield budget
+
+def stream_alert_pages(url, key, params):
+    total, page_no = 0, 0
+    for item in collect_alert_pages(url, key, params):
+        if isinstance(item, PageBudget):
+            summary = {"done": True, "total": total, "pages": page_no, "truncated": item.exhausted}
+            yield json.dumps({"jsonrpc": "2.0", "id": 1, "result": summary}) + "\n"
+        elif isinstance(item, Exception):
+            yield json.dumps({"jsonrpc": "2.0", "id": 1, "error": str(item)}) + "\n"
+        else:
+            page_no += 1
+            total += len(item)
+            yield json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"page": page_no, "items": item}}) + "\n"
+
 @app.post("/")
 def handle_mcp(request: MCPRequest):
     client = request.params.get("client", "DEFAULT")
@@ -31,4 +146,24 @@ def handle_mcp(request: MCPRequest):
             params=params
         )
         return {"jsonrpc": "2.0", "id": 1, "result": resp.json()}
+
+    if request.method == "collect_workbench_alerts":
+        if request.params.get("stream"):
+            return StreamingResponse(stream_alert_pages(url, key, request.params), media_type="application/x-ndjson")
+        alerts, errors, pages, truncated = [], [], 0, False
+        for item in collect_alert_pages(url, key, request.params):
+            if isinstance(item, PageBudget):
+                truncated = item.exhausted
+            elif isinstance(item, Exception):
+                errors.append(str(item))
+            else:
+                pages += 1
+                alerts.extend(item)
+        if pages == 0 and errors:
+            # Sin ninguna página no es "cero alertas": se reporta como error para que no se cachee
+            return {"jsonrpc": "2.0", "id": 1, "error": f"TrendMicro fetch failed: {'; '.join(errors)}"}
+        result = {"items": alerts, "count": len(alerts), "pages": pages, "truncated": truncated}
+        if errors:
+            result["errors"] = errors
+        return {"jsonrpc": "2.0", "id": 1, "result": result}
     return {"jsonrpc": "2.0", "id": 1, "error": "Method not supported"}
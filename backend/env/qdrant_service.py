@@ -1,23 +1,284 @@
 import os
+import time
+import queue
 import logging
+import threading
 from datetime import datetime, timezone
 from typing import Optional, List, Tuple, Dict, Any
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from sentence_transformers import SentenceTransformer
+from embedding_backend import embedding_backend, load_embedding_model
 import tiktoken
+import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
+from functools import lru_cache
+from embedding_cache import EmbeddingCache
+from embedding_batcher import EmbeddingBatcher
+from lazy_components import LazyComponent
+from collection_profile import load_profile, create_collection_kwargs, search_params
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Payload fields every query filters, orders or facets on ("day" backs the per-day stats)
+PAYLOAD_INDEXES = {
+    "model": models.PayloadSchemaType.KEYWORD,
+    "session_id": models.PayloadSchemaType.KEYWORD,
+    "timestamp": models.PayloadSchemaType.DATETIME,
+    "day": models.PayloadSchemaType.KEYWORD,
+    "iocs": models.PayloadSchemaType.KEYWORD,
+    # Cliente (COS_L, SUMA...): índice optimizado para tenants, co-localiza los puntos de cada uno
+    "tenant": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+}
+
+# Tenant de los turnos en los que no se detectó cliente; las búsquedas sin tenant no se filtran
+DEFAULT_TENANT = "DEFAULT"
+
+# Server-side ordering for history/last-turn queries (uses the timestamp datetime index)
+_NEWEST_FIRST = models.OrderBy(key="timestamp", direction=models.Direction.DESC)
+
+# Sentinel that tells the write-behind thread to exit once the queue is drained
+_STOP = object()
+
+@lru_cache(maxsize=1)
+def _token_encoding():
+    """Process-wide tiktoken encoding; building it is far more expensive than using it."""
+    try:
+        return tiktoken.encoding_for_model("gpt-4")
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def _token_counts(user_message: str, chatbot_response: str) -> Dict[str, int]:
+    encoding = _token_encoding()
+    return {
+        "user_message": len(encoding.encode(user_message)),
+        "chatbot_response": len(encoding.encode(chatbot_response)),
+    }
+
+def _format_context_entry(label: str, user_message: str, chatbot_response: str, timestamp: str) -> str:
+    return (
+        f"---\n"
+        f"{label}\n"
+        f"👤 **Usuario:** {user_message}\n"
+        f"🤖 **MATEO:** {chatbot_response}\n"
+        f"📅 **Fecha:** {timestamp[:19]}\n"
+    )
+
+def normalize_iocs(iocs: Optional[List[str]]) -> List[str]:
+    """Lowercase and dedupe IoCs so hashes/emails match regardless of how they were typed."""
+    return list(dict.fromkeys(i.strip().lower() for i in iocs or [] if i and i.strip()))
+
+@lru_cache(maxsize=2)
+def _entry_overhead(is_current: bool) -> int:
+    """Tokens the entry template adds around the two messages, plus a margin for boundary merges."""
+    label = '🔹 [SESIÓN ACTUAL]' if is_current else '🔸 [SESIÓN 0f3a9c1e]'
+    entry = _format_context_entry(label, "", "", "2025-01-01T00:00:00")
+    return len(_token_encoding().encode(entry)) + 4
+
+def _tenant_conditions(tenant: Optional[str]) -> List[models.FieldCondition]:
+    if not tenant or tenant == DEFAULT_TENANT:
+        return []
+    return [models.FieldCondition(key="tenant", match=models.MatchValue(value=tenant))]
+
+def _model_filter(model: str, session_id: Optional[str] = None, tenant: Optional[str] = None, strict_tenant: bool = False) -> models.Filter:
+    must_conditions = _tenant_conditions(tenant) + [
+        models.FieldCondition(key="model", match=models.MatchValue(value=model))
+    ]
+    if session_id:
+        must_conditions.append(
+            models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))
+        )
+    must_not = None
+    if strict_tenant and (not tenant or tenant == DEFAULT_TENANT):
+        # Sin cliente solo se ven turnos sin cliente (o anteriores a los tenants), nunca los de otro
+        must_not = [models.FieldCondition(key="tenant", match=models.MatchExcept(**{"except": [DEFAULT_TENANT]}))]
+    return models.Filter(must=must_conditions, must_not=must_not)
+
+def _session_first_requests(model: str, session_id: Optional[str], query: Any, limit: int, params: Optional[models.SearchParams] = None, tenant: Optional[str] = None, strict_tenant: bool = False) -> List[models.QueryRequest]:
+    """Session-scoped request first, then the model-wide fallback (only when there is a session).
+
+    With strict_tenant the fallback never crosses tenants, not even for DEFAULT_TENANT.
+    """
+    requests = [
+        models.QueryRequest(query=query, filter=_model_filter(model, session_id, tenant), limit=limit, params=params, with_payload=True, with_vector=False)
+    ]
+    if session_id:
+        requests.append(
+            models.QueryRequest(query=query, filter=_model_filter(model, tenant=tenant, strict_tenant=strict_tenant), limit=limit, params=params, with_payload=True, with_vector=False)
+        )
+    return requests
+
+def _pick_session_first(responses: List[Any], model: str, session_id: Optional[str]) -> List[Any]:
+    if responses[0].points or not session_id:
+        return responses[0].points
+    logger.info(f"No conversations found for model {model} and session {session_id}, using model-wide results")
+    return responses[1].points
+
+def _pending_write(conversation_id: str, session_id: str, user_message: str, chatbot_response: str, model: str, metadata: Optional[Dict[str, Any]], iocs: Optional[List[str]], tenant: Optional[str] = None) -> Dict[str, Any]:
+    document = {
+        "user_message": user_message,
+        "chatbot_response": chatbot_response,
+        "model": model,
+        "session_id": session_id,
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    if metadata:
+        document.update(metadata)
+    return {
+        "conversation_id": conversation_id,
+        "document": document,
+        "metadata": metadata or {},
+        "iocs": normalize_iocs(iocs),
+        "tenant": tenant or DEFAULT_TENANT,
+        "text": f"{user_message} {chatbot_response}"
+    }
+
+def _build_points(pending: List[Dict[str, Any]], embeddings: List[np.ndarray]) -> List[models.PointStruct]:
+    return [
+        models.PointStruct(
+            id=p["conversation_id"],
+            vector=embedding.tolist(),
+            payload={
+                "document": p["document"],
+                "token_count": _token_counts(p["document"]["user_message"], p["document"]["chatbot_response"]),
+                "conversation_id": p["conversation_id"],
+                "session_id": p["document"]["session_id"],
+                "model": p["document"]["model"],
+                "timestamp": p["document"]["timestamp"],
+                "day": p["document"]["timestamp"][:10],
+                "iocs": p.get("iocs", []),
+                "tenant": p.get("tenant", DEFAULT_TENANT),
+                "metadata": p["metadata"]
+            }
+        )
+        for p, embedding in zip(pending, embeddings)
+    ]
+
+def _format_search_context(points: List[Any], session_id: Optional[str], max_tokens: int = 8100) -> str:
+    """Format vector hits newest first until the token budget is used up."""
+    if not points:
+        logger.warning("⚠️ No conversations found in Qdrant")
+        return "No se encontraron conversaciones relevantes en la base de datos."
+
+    # Recency order among the top-k semantic hits (vector search is ordered by score)
+    points = sorted(
+        points,
+        key=lambda p: p.payload.get('document', {}).get('timestamp', ''),
+        reverse=True
+    )
+    
+    total_tokens = 0
+    context_lines = []
+    
+    for point in points:
+        doc = point.payload.get('document', {})
+        user_message = doc.get('user_message', 'N/A')
+        chatbot_response = doc.get('chatbot_response', 'N/A')
+        timestamp = doc.get('timestamp', 'Sin fecha')
+        result_session_id = doc.get('session_id', 'N/A')
+        
+        is_current = result_session_id == session_id
+        
+        # Stored counts + fixed template overhead; only legacy points are re-tokenized
+        counts = point.payload.get('token_count') or _token_counts(user_message, chatbot_response)
+        tokens = _entry_overhead(is_current) + counts["user_message"] + counts["chatbot_response"]
+        if total_tokens + tokens > max_tokens:
+            logger.info(f"🔄 Token limit of {max_tokens} reached: {total_tokens}/{max_tokens}")
+            break
+            
+        context_lines.append(_format_context_entry(
+            '🔹 [SESIÓN ACTUAL]' if is_current else f'🔸 [SESIÓN {result_session_id[:8]}]',
+            user_message, chatbot_response, timestamp
+        ))
+        total_tokens += tokens
+    
+    context = "".join(context_lines)
+    logger.info(f"✅ Context retrieved: {len(context_lines)} conversations, {total_tokens} tokens")
+    return context if context else "No se encontraron conversaciones relevantes en la base de datos."
+
+def _session_tenant_filter(session_id: str) -> models.Filter:
+    return models.Filter(
+        must=[models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))],
+        must_not=[models.FieldCondition(key="tenant", match=models.MatchValue(value=DEFAULT_TENANT))]
+    )
+
+def _untagged_session_filter(session_id: str) -> models.Filter:
+    return models.Filter(must=[
+        models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id)),
+        models.FieldCondition(key="tenant", match=models.MatchValue(value=DEFAULT_TENANT))
+    ])
+
+def _ioc_filter(iocs: List[str], tenant: Optional[str] = None) -> models.Filter:
+    return models.Filter(must=_tenant_conditions(tenant) + [models.FieldCondition(key="iocs", match=models.MatchAny(any=iocs))])
+
+def _format_ioc_context(points: List[Any], iocs: List[str], max_tokens: int) -> str:
+    total_tokens = 0
+    context_lines = []
+    for point in points:
+        doc = point.payload.get('document', {})
+        user_message = doc.get('user_message', 'N/A')
+        chatbot_response = doc.get('chatbot_response', 'N/A')
+        matched = [i for i in point.payload.get('iocs', []) if i in iocs]
+        label = f"🎯 [IoC {', '.join(matched)} | SESIÓN {doc.get('session_id', 'N/A')[:8]}]"
+        
+        counts = point.payload.get('token_count') or _token_counts(user_message, chatbot_response)
+        tokens = _entry_overhead(False) + len(_token_encoding().encode(label)) + counts["user_message"] + counts["chatbot_response"]
+        if total_tokens + tokens > max_tokens:
+            break
+        context_lines.append(_format_context_entry(label, user_message, chatbot_response, doc.get('timestamp', 'Sin fecha')))
+        total_tokens += tokens
+    
+    logger.info(f"🎯 IoC lookup: {len(points)} matches for {len(iocs)} IoCs, {len(context_lines)} in context")
+    return "".join(context_lines)
+
+def _stats_summary(total_count: int, sessions: Dict[str, int], per_model: Dict[str, int], per_day: Dict[str, int], facet_limit: int) -> Dict[str, Any]:
+    # Un facet que llena el límite puede tener más valores: unique_sessions es entonces un mínimo
+    sessions_truncated = len(sessions) >= facet_limit
+    if sessions_truncated:
+        logger.warning(f"⚠️ Session facet hit QDRANT_STATS_FACET_LIMIT={facet_limit}; unique_sessions is a lower bound")
+    logger.info(f"📊 Stats: {total_count} conversations, {len(sessions)} sessions")
+    return {
+        "total_conversations": total_count,
+        "unique_sessions": len(sessions),
+        "unique_sessions_truncated": sessions_truncated,
+        "per_model": per_model,
+        "per_day": dict(sorted(per_day.items()))
+    }
+
+def _conversation_dict(point: Any) -> Dict[str, Any]:
+    doc = point.payload.get('document', {})
+    return {
+        "conversation_id": point.payload.get("conversation_id", ""),
+        "session_id": doc.get("session_id", ""),
+        "user_message": doc.get("user_message", ""),
+        "chatbot_response": doc.get("chatbot_response", ""),
+        "timestamp": doc.get("timestamp", ""),
+        "model": doc.get("model", ""),
+        "metadata": point.payload.get("metadata", {})
+    }
+
+def _last_turn(points: List[Any], model: str) -> Tuple[str, str]:
+    if not points:
+        logger.info(f"No conversations found for model {model}")
+        return "", ""
+    doc = points[0].payload.get("document", {})
+    user_message = doc.get("user_message", "")
+    chatbot_response = doc.get("chatbot_response", "")
+    
+    if not user_message and not chatbot_response:
+        logger.warning(f"Incomplete data in last conversation for model {model}")
+        return "", ""
+    
+    logger.info(f"✅ Retrieved last conversation for model {model}")
+    return user_message, chatbot_response
+
 class QdrantService:
     """Service class to handle Qdrant vector database operations for MATEO with persistent memory."""
     
-    def __init__(self):
-        """Initialize Qdrant client and embedding model."""
+    def __init__(self, embedding: Optional[LazyComponent] = None):
+        """Initialize Qdrant client; the embedding model is loaded on first use unless warmed up."""
         # Load environment variables
         dotenv_path = Path(__file__).resolve().parent / ".env"
         load_dotenv(dotenv_path)
@@ -39,223 +300,299 @@ class QdrantService:
             logger.error(f"❌ Failed to connect to Qdrant: {e}")
             raise ValueError(f"Failed to connect to Qdrant: {e}")
         
-        # Initialize embedding model
-        try:
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-            logger.info("✅ Embedding model loaded")
-        except Exception as e:
-            logger.error(f"❌ Failed to load embedding model: {e}")
-            raise ValueError(f"Failed to load embedding model: {e}")
+        # Embedding model (lazy)
+        self.embedding_backend = embedding_backend()
+        self.embedding = embedding or LazyComponent(
+            "embedding_model", lambda: load_embedding_model(self.embedding_backend)
+        )
+        self.embedding_cache = EmbeddingCache.from_env(f"all-MiniLM-L6-v2:{self.embedding_backend}")
+        self.embedding_batcher = EmbeddingBatcher.from_env(
+            lambda texts, batch_size: self.embedding_model.encode(texts, batch_size=batch_size)
+        )
         
         # Collection configuration
         self.collection_name = "mateo_conversations"
+        self.stats_facet_limit = int(os.getenv("QDRANT_STATS_FACET_LIMIT", "10000"))
+        # Existing collections keep their settings; collection_profile.py migrate applies changes
+        self.collection_profile = load_profile()
+        self.search_params = search_params(self.collection_profile)
         self._initialize_collection()
 
+        # Write-behind persistence
+        self.write_behind = os.getenv("QDRANT_WRITE_BEHIND", "true").lower() == "true"
+        self.write_batch_size = int(os.getenv("QDRANT_WRITE_BATCH_SIZE", "32"))
+        self.write_flush_interval = float(os.getenv("QDRANT_WRITE_FLUSH_SECONDS", "1.0"))
+        self._write_queue = queue.Queue()
+        if self.write_behind:
+            self._writer = threading.Thread(target=self._writer_loop, name="qdrant-write-behind", daemon=True)
+            self._writer.start()
+
     def _initialize_collection(self):
         """Create Qdrant collection if it doesn't exist with optimized configuration."""
         try:
             if not self.client.collection_exists(collection_name=self.collection_name):
                 self.client.create_collection(
                     collection_name=self.collection_name,
-                    vectors_config=models.VectorParams(
-                        size=384,
-                        distance=models.Distance.COSINE,
-                        on_disk=True
-                    ),
-                    optimizers_config=models.OptimizersConfigDiff(
-                        indexing_threshold=0,
-                        memmap_threshold=20000
-                    )
+                    **create_collection_kwargs(self.collection_profile)
                 )
                 logger.info(f"✅ Created Qdrant collection: {self.collection_name}")
             else:
                 logger.info(f"✅ Qdrant collection {self.collection_name} already exists")
+            self._ensure_payload_indexes()
         except Exception as e:
             logger.error(f"❌ Failed to initialize Qdrant collection: {e}")
             raise
 
-    def store_conversation(self, conversation_id: str, session_id: str, user_message: str, chatbot_response: str, model: str, metadata: Dict[str, Any] = None):
-        """Store a conversation in Qdrant with a session_id for tracking and additional metadata."""
-        try:
-            document = {
-                "user_message": user_message,
-                "chatbot_response": chatbot_response,
-                "model": model,
-                "session_id": session_id,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-            if metadata:
-                document.update(metadata)
-            
-            text_to_embed = f"{user_message} {chatbot_response}"
-            embedding = self.embedding_model.encode([text_to_embed])[0]
-            
-            point = models.PointStruct(
-                id=conversation_id,
-                vector=embedding.tolist(),
-                payload={
-                    "document": document,
-                    "conversation_id": conversation_id,
-                    "session_id": session_id,
-                    "model": model,
-                    "timestamp": document["timestamp"],
-                    "metadata": metadata or {}
-                }
+    def _ensure_payload_indexes(self):
+        """Create missing payload indexes; existing collections are migrated in place."""
+        existing = self.client.get_collection(collection_name=self.collection_name).payload_schema or {}
+        for field_name, schema in PAYLOAD_INDEXES.items():
+            if field_name in existing:
+                continue
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=schema,
+                wait=True
             )
-            
-            for attempt in range(3):
-                try:
-                    self.client.upsert(
-                        collection_name=self.collection_name,
-                        points=[point],
-                        wait=True
-                    )
-                    logger.info(f"✅ Stored conversation {conversation_id} in Qdrant (model: {model}, session: {session_id})")
-                    break
-                except Exception as e:
-                    logger.warning(f"⚠️ Retry {attempt + 1}/3: Failed to store conversation {conversation_id}: {e}")
-                    if attempt == 2:
-                        raise
+            logger.info(f"✅ Created payload index {field_name} ({schema}) on {self.collection_name}")
+        self._backfill_day()
+
+    def _backfill_day(self, batch_size: int = 1000):
+        """Derive "day" from "timestamp" on points stored before the field existed, so per_day adds up."""
+        offset = None
+        updated = 0
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(must=[models.IsEmptyCondition(is_empty=models.PayloadField(key="day"))]),
+                limit=batch_size,
+                offset=offset,
+                with_payload=["timestamp"],
+                with_vectors=False
+            )
+            by_day: Dict[str, List[Any]] = {}
+            for point in points:
+                timestamp = point.payload.get("timestamp")
+                if timestamp:
+                    by_day.setdefault(timestamp[:10], []).append(point.id)
+            for day, ids in by_day.items():
+                self.client.set_payload(collection_name=self.collection_name, payload={"day": day}, points=ids, wait=True)
+                updated += len(ids)
+            if offset is None:
+                break
+        if updated:
+            logger.info(f"✅ Backfilled day on {updated} points of {self.collection_name}")
+
+    @property
+    def embedding_model(self):
+        return self.embedding.get()
+
+    def _embed(self, texts: List[str]) -> List[np.ndarray]:
+        """Encode texts, serving repeated content from the embedding cache."""
+        vectors = self.embedding_cache.get_many(texts)
+        pending = list(dict.fromkeys(t for i, t in enumerate(texts) if i not in vectors))
+        if pending:
+            encoded = self.embedding_batcher.encode(pending)
+            self.embedding_cache.put_many(pending, encoded)
+            by_text = dict(zip(pending, encoded))
+            for i, text in enumerate(texts):
+                if i not in vectors:
+                    vectors[i] = by_text[text]
+        return [vectors[i] for i in range(len(texts))]
+
+    def store_conversation(self, conversation_id: str, session_id: str, user_message: str, chatbot_response: str, model: str, metadata: Dict[str, Any] = None, iocs: Optional[List[str]] = None, tenant: Optional[str] = None):
+        """Store a conversation in Qdrant with a session_id for tracking and additional metadata.
+
+        iocs (IPs, hashes, emails detected in the message) go to an indexed keyword field
+        so search_ioc_mentions can find them by exact match. tenant is the customer the turn
+        belongs to (DEFAULT_TENANT when none was detected).
+
+        With write-behind enabled the conversation is queued and persisted in batches by a
+        background thread, so the caller never waits on embedding or the upsert.
+        """
+        pending = _pending_write(conversation_id, session_id, user_message, chatbot_response, model, metadata, iocs, tenant)
+
+        if self.write_behind:
+            self._write_queue.put(pending)
+            logger.info(f"📥 Queued conversation {conversation_id} for write-behind (model: {model}, session: {session_id})")
+            return
+
+        try:
+            self._write_batch([pending], raise_on_error=True)
         except Exception as e:
             logger.error(f"❌ Failed to store conversation in Qdrant: {type(e).__name__} - {str(e)}")
             raise
 
-    def search_conversations(self, query: str, model: str, session_id: str, limit: int = 15, similarity_threshold: float = 0.3, include_all_sessions: bool = False) -> str:
-        """Search for relevant conversations in Qdrant, optionally across all sessions, and return formatted context."""
-        try:
-            query = query.strip().lower()
-            query_embedding = self.embedding_model.encode([query])[0]
-            
-            # Tokenization setup
+    def _write_batch(self, pending: List[Dict[str, Any]], raise_on_error: bool = False):
+        """Embed and upsert a batch of conversations in a single encode call and a single upsert."""
+        points = _build_points(pending, self._embed([p["text"] for p in pending]))
+
+        for attempt in range(3):
             try:
-                encoding = tiktoken.encoding_for_model("gpt-4")
-            except KeyError:
-                encoding = tiktoken.get_encoding("cl100k_base")
-            
-            # Fetch conversations with vector search
-            must_conditions = [
-                models.FieldCondition(key="model", match=models.MatchValue(value=model))
-            ]
-            if session_id and not include_all_sessions:
-                must_conditions.append(
-                    models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))
-                )
-            
-            search_result = self.client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding.tolist(),
-                query_filter=models.Filter(must=must_conditions),
-                limit=limit,
-                with_payload=True,
-                with_vectors=False
-            )
-            
-            points = search_result
-            if not points and session_id and not include_all_sessions:
-                logger.info(f"No conversations found for model {model} and session {session_id}, trying without session filter")
-                search_result = self.client.search(
+                self.client.upsert(
                     collection_name=self.collection_name,
-                    query_vector=query_embedding.tolist(),
-                    query_filter=models.Filter(
-                        must=[models.FieldCondition(key="model", match=models.MatchValue(value=model))]
-                    ),
-                    limit=limit,
-                    with_payload=True,
-                    with_vectors=False
-                )
-                points = search_result
-            
-            if not points:
-                logger.warning("⚠️ No conversations found in Qdrant")
-                return "No se encontraron conversaciones relevantes en la base de datos."
-
-            # Sort points by timestamp (newest first)
-            points = sorted(
-                points,
-                key=lambda p: p.payload.get('document', {}).get('timestamp', ''),
-                reverse=True
-            )
-            
-            total_tokens = 0
-            context_lines = []
-            max_tokens = 8100
-            
-            for point in points:
-                doc = point.payload.get('document', {})
-                user_message = doc.get('user_message', 'N/A')
-                chatbot_response = doc.get('chatbot_response', 'N/A')
-                timestamp = doc.get('timestamp', 'Sin fecha')
-                result_session_id = doc.get('session_id', 'N/A')
-                
-                context_entry = (
-                    f"---\n"
-                    f"{'🔹 [SESIÓN ACTUAL]' if result_session_id == session_id else f'🔸 [SESIÓN {result_session_id[:8]}]'}\n"
-                    f"👤 **Usuario:** {user_message}\n"
-                    f"🤖 **MATEO:** {chatbot_response}\n"
-                    f"📅 **Fecha:** {timestamp[:19]}\n"
+                    points=points,
+                    wait=True
                 )
-                
-                tokens = len(encoding.encode(context_entry))
-                if total_tokens + tokens > max_tokens:
-                    logger.info(f"🔄 Token limit of 8100 reached: {total_tokens}/{max_tokens}")
+                logger.info(f"✅ Stored {len(points)} conversation(s) in Qdrant")
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Retry {attempt + 1}/3: Failed to store {len(points)} conversation(s): {e}")
+                if attempt == 2:
+                    if raise_on_error:
+                        raise
+                    ids = [p["conversation_id"] for p in pending]
+                    logger.error(f"❌ Dropped {len(ids)} conversation(s) after 3 attempts: {ids}")
+
+    def _writer_loop(self):
+        """Collect queued conversations until the batch is full or the flush interval expires."""
+        while True:
+            item = self._write_queue.get()
+            if item is _STOP:
+                self._write_queue.task_done()
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.write_flush_interval
+            while len(batch) < self.write_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._write_queue.get(timeout=remaining)
+                except queue.Empty:
                     break
-                    
-                context_lines.append(context_entry)
-                total_tokens += tokens
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logger.error(f"❌ Write-behind batch failed: {type(e).__name__} - {str(e)}")
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+            if stop:
+                self._write_queue.task_done()
+                return
+
+    def flush(self):
+        """Block until every queued conversation has been persisted."""
+        if self.write_behind:
+            self._write_queue.join()
+
+    def close(self, timeout: float = 30.0):
+        """Drain the write-behind queue and stop the writer thread."""
+        if self.write_behind and self._writer.is_alive():
+            self._write_queue.put(_STOP)
+            self._writer.join(timeout=timeout)
+            if self._writer.is_alive():
+                logger.warning(f"⚠️ Write-behind writer did not drain within {timeout}s ({self._write_queue.qsize()} pending)")
+            else:
+                logger.info("✅ Write-behind queue drained")
+
+    def _query_session_first(self, model: str, session_id: Optional[str], query: Any, limit: int, params: Optional[models.SearchParams] = None, tenant: Optional[str] = None, strict_tenant: bool = False) -> List[Any]:
+        """Run the session-scoped and the model-wide query in one batch request.
+
+        Returns the session results when there are any and the model-wide ones otherwise,
+        so a new session costs one round trip instead of filter-then-fallback.
+        """
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=_session_first_requests(model, session_id, query, limit, params, tenant, strict_tenant)
+        )
+        return _pick_session_first(responses, model, session_id)
+
+    def search_conversations(self, query: str, model: str, session_id: str, limit: int = 15, similarity_threshold: float = 0.3, include_all_sessions: bool = False, tenant: Optional[str] = None, strict_tenant: bool = False) -> str:
+        """Search for relevant conversations in Qdrant, optionally across all sessions, and return formatted context.
+
+        With a tenant other than DEFAULT_TENANT only that customer's conversations are searched;
+        strict_tenant keeps DEFAULT_TENANT searches away from the customers' conversations too.
+        """
+        try:
+            query = query.strip().lower()
+            query_embedding = self._embed([query])[0]
+            
+            # Session-scoped and model-wide candidates in a single round trip
+            points = self._query_session_first(
+                model,
+                None if include_all_sessions else session_id,
+                query_embedding.tolist(),
+                limit,
+                self.search_params,
+                tenant,
+                strict_tenant
+            )
             
-            context = "".join(context_lines)
-            logger.info(f"✅ Context retrieved: {len(context_lines)} conversations, {total_tokens} tokens")
-            return context if context else "No se encontraron conversaciones relevantes en la base de datos."
+            return _format_search_context(points, session_id)
             
         except Exception as e:
             logger.error(f"❌ Error searching in Qdrant: {type(e).__name__} - {str(e)}")
             return "Error al buscar conversaciones en la base de datos."
 
-    def get_conversation_data(self, model: str, session_id: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
-        """Retrieve comprehensive conversation data from Qdrant."""
+    def search_ioc_mentions(self, iocs: List[str], max_tokens: int = 2000, limit: int = 20, tenant: Optional[str] = None) -> str:
+        """Find past conversations (any model or session of the tenant) that mention the given IoCs.
+
+        Exact match on the indexed "iocs" payload field, newest first; returns formatted
+        context or "" when there is nothing to add.
+        """
+        iocs = normalize_iocs(iocs)
+        if not iocs:
+            return ""
         try:
-            must_conditions = [
-                models.FieldCondition(key="model", match=models.MatchValue(value=model))
-            ]
-            if session_id:
-                must_conditions.append(
-                    models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))
-                )
-            
-            scroll_result = self.client.scroll(
+            points, _ = self.client.scroll(
                 collection_name=self.collection_name,
-                scroll_filter=models.Filter(must=must_conditions),
+                scroll_filter=_ioc_filter(iocs, tenant),
                 limit=limit,
                 with_payload=True,
-                with_vectors=False
+                with_vectors=False,
+                order_by=_NEWEST_FIRST
             )
+            return _format_ioc_context(points, iocs, max_tokens)
             
-            points = scroll_result[0]
-            if not points and session_id:
-                logger.info(f"No conversations found for model {model} and session {session_id}, trying without session filter")
-                scroll_result = self.client.scroll(
-                    collection_name=self.collection_name,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="model", match=models.MatchValue(value=model))]
-                    ),
-                    limit=limit,
-                    with_payload=True,
-                    with_vectors=False
-                )
-                points = scroll_result[0]
+        except Exception as e:
+            logger.error(f"❌ Error in IoC lookup: {type(e).__name__} - {str(e)}")
+            return ""
+
+    def get_session_tenant(self, session_id: str) -> Optional[str]:
+        """Customer of the latest turn of the session that had one, or None."""
+        try:
+            points, _ = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=_session_tenant_filter(session_id),
+                limit=1,
+                with_payload=["tenant"],
+                with_vectors=False,
+                order_by=_NEWEST_FIRST
+            )
+            return points[0].payload.get("tenant") if points else None
+        except Exception as e:
+            logger.error(f"❌ Error resolving session tenant: {type(e).__name__} - {str(e)}")
+            return None
+
+    def assign_session_tenant(self, session_id: str, tenant: str):
+        """Move the session's turns stored without a customer (DEFAULT_TENANT) to tenant."""
+        try:
+            self.client.set_payload(
+                collection_name=self.collection_name,
+                payload={"tenant": tenant},
+                points=_untagged_session_filter(session_id),
+                wait=False
+            )
+            logger.info(f"🏷️ Session {session_id[:8]} assigned to tenant {tenant}")
+        except Exception as e:
+            logger.error(f"❌ Error assigning session tenant: {type(e).__name__} - {str(e)}")
+
+    def get_conversation_data(self, model: str, session_id: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        """Retrieve comprehensive conversation data from Qdrant."""
+        try:
+            points = self._query_session_first(
+                model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), limit
+            )
             
-            conversations = []
-            for point in points:
-                doc = point.payload.get('document', {})
-                conversations.append({
-                    "conversation_id": point.payload.get("conversation_id", ""),
-                    "session_id": doc.get("session_id", ""),
-                    "user_message": doc.get("user_message", ""),
-                    "chatbot_response": doc.get("chatbot_response", ""),
-                    "timestamp": doc.get("timestamp", ""),
-                    "model": doc.get("model", ""),
-                    "metadata": point.payload.get("metadata", {})
-                })
+            conversations = [_conversation_dict(point) for point in points]
             
             stats = self.get_conversation_stats(model)
             logger.info(f"✅ Retrieved {len(conversations)} conversations with stats")
@@ -269,104 +606,31 @@ class QdrantService:
             logger.error(f"❌ Error retrieving conversation data: {type(e).__name__} - {str(e)}")
             return {"conversations": [], "stats": {}, "total_conversations": 0}
 
-    def get_last_conversation(self, model: str, session_id: Optional[str] = None) -> Tuple[str, str]:
-        """Retrieve the last stored conversation for the specified model and session."""
+    def get_last_conversation(self, model: str, session_id: Optional[str] = None, tenant: Optional[str] = None) -> Tuple[str, str]:
+        """Retrieve the last stored conversation for the specified model and session.
+
+        With a tenant, the fallback for a session without turns stays inside that tenant
+        (DEFAULT_TENANT included), so it never returns another customer's conversation.
+        """
         try:
-            must_conditions = [
-                models.FieldCondition(key="model", match=models.MatchValue(value=model))
-            ]
-            if session_id:
-                must_conditions.append(
-                    models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))
-                )
-            
-            search_result = self.client.scroll(
-                collection_name=self.collection_name,
-                scroll_filter=models.Filter(must=must_conditions),
-                limit=1,
-                with_payload=True,
-                with_vectors=False
+            points = self._query_session_first(
+                model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), 1,
+                tenant=tenant, strict_tenant=tenant is not None
             )
-            
-            points = search_result[0]
-            if not points:
-                if session_id:
-                    logger.info(f"No conversations found for model {model} and session {session_id}, trying without session filter")
-                    search_result = self.client.scroll(
-                        collection_name=self.collection_name,
-                        scroll_filter=models.Filter(
-                            must=[models.FieldCondition(key="model", match=models.MatchValue(value=model))]
-                        ),
-                        limit=1,
-                        with_payload=True,
-                        with_vectors=False
-                    )
-                    points = search_result[0]
-                
-                if not points:
-                    logger.info(f"No conversations found for model {model}")
-                    return "", ""
-            
-            last_point = points[0]
-            doc = last_point.payload.get("document", {})
-            user_message = doc.get("user_message", "")
-            chatbot_response = doc.get("chatbot_response", "")
-            
-            if not user_message and not chatbot_response:
-                logger.warning(f"Incomplete data in last conversation for model {model}")
-                return "", ""
-            
-            logger.info(f"✅ Retrieved last conversation for model {model}")
-            return user_message, chatbot_response
+            return _last_turn(points, model)
         except Exception as e:
             logger.error(f"❌ Error retrieving last conversation: {type(e).__name__} - {str(e)}")
             return "", ""
 
-    def get_conversation_history(self, model: str, session_id: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
-        """Retrieve a list of recent conversations for the specified model and session."""
+    def get_conversation_history(self, model: str, session_id: Optional[str] = None, limit: int = 10, tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Retrieve a list of recent conversations for the specified model and session (tenant as in get_last_conversation)."""
         try:
-            must_conditions = [
-                models.FieldCondition(key="model", match=models.MatchValue(value=model))
-            ]
-            if session_id:
-                must_conditions.append(
-                    models.FieldCondition(key="session_id", match=models.MatchValue(value=session_id))
-                )
-            
-            scroll_result = self.client.scroll(
-                collection_name=self.collection_name,
-                scroll_filter=models.Filter(must=must_conditions),
-                limit=limit,
-                with_payload=True,
-                with_vectors=False
+            points = self._query_session_first(
+                model, session_id, models.OrderByQuery(order_by=_NEWEST_FIRST), limit,
+                tenant=tenant, strict_tenant=tenant is not None
             )
             
-            points = scroll_result[0]
-            if not points and session_id:
-                logger.info(f"No conversations found for model {model} and session {session_id}, trying without session filter")
-                scroll_result = self.client.scroll(
-                    collection_name=self.collection_name,
-                    scroll_filter=models.Filter(
-                        must=[models.FieldCondition(key="model", match=models.MatchValue(value=model))]
-                    ),
-                    limit=limit,
-                    with_payload=True,
-                    with_vectors=False
-                )
-                points = scroll_result[0]
-            
-            history = []
-            for point in points:
-                doc = point.payload.get("document", {})
-                history.append({
-                    "conversation_id": point.payload.get("conversation_id", ""),
-                    "session_id": doc.get("session_id", ""),
-                    "user_message": doc.get("user_message", ""),
-                    "chatbot_response": doc.get("chatbot_response", ""),
-                    "timestamp": doc.get("timestamp", ""),
-                    "model": doc.get("model", ""),
-                    "metadata": point.payload.get("metadata", {})
-                })
+            history = [_conversation_dict(point) for point in points]
             
             logger.info(f"✅ Retrieved {len(history)} conversations for history (model: {model})")
             return history
@@ -403,29 +667,36 @@ class QdrantService:
             logger.error(f"❌ Error debugging Qdrant content: {e}")
             return 0
 
-    def get_conversation_stats(self, model: str = "openai") -> Dict[str, int]:
-        """Return statistics about stored conversations."""
+    def _facet_counts(self, key: str, facet_filter: Optional[models.Filter] = None) -> Dict[str, int]:
+        """Exact value -> count map for an indexed keyword field, without transferring payloads."""
+        response = self.client.facet(
+            collection_name=self.collection_name,
+            key=key,
+            facet_filter=facet_filter,
+            limit=self.stats_facet_limit,
+            exact=True
+        )
+        return {str(hit.value): hit.count for hit in response.hits}
+
+    def get_conversation_stats(self, model: str = "openai") -> Dict[str, Any]:
+        """Return statistics about stored conversations using count/facet on the payload indexes.
+
+        Totals are exact; unique_sessions is capped at QDRANT_STATS_FACET_LIMIT and flagged
+        with unique_sessions_truncated when the cap is reached.
+        """
         try:
-            total_count = self.debug_content(model, limit=100)
-            
-            scroll_result = self.client.scroll(
+            model_filter = _model_filter(model)
+            total_count = self.client.count(
                 collection_name=self.collection_name,
-                scroll_filter=models.Filter(
-                    must=[models.FieldCondition(key="model", match=models.MatchValue(value=model))]
-                ),
-                limit=100,
-                with_payload=True
-            )
-            
-            sessions = set()
-            for point in scroll_result[0]:
-                session_id = point.payload.get('document', {}).get('session_id')
-                if session_id:
-                    sessions.add(session_id)
-            
-            logger.info(f"📊 Stats: {total_count} conversations, {len(sessions)} sessions")
-            return {"total_conversations": total_count, "unique_sessions": len(sessions)}
+                count_filter=model_filter,
+                exact=True
+            ).count
+            sessions = self._facet_counts("session_id", model_filter)
+            per_model = self._facet_counts("model")
+            per_day = self._facet_counts("day", model_filter)
+
+            return _stats_summary(total_count, sessions, per_model, per_day, self.stats_facet_limit)
             
         except Exception as e:
             logger.error(f"❌ Error getting stats: {e}")
-            return {"total_conversations": 0}
\ No newline at end of file
+            return {"total_conversations": 0}
@@ -129,6 +129,11 @@ function Chat({ onBotonClick }: ChatProps) {
   const toggleMenu = () => setMenuOpen(prev => !prev);
 
   useEffect(() => {
+    // Los mensajes transmitidos por SSE ya se pintan incrementalmente
+    if (messages.length > 0 && messages[messages.length - 1].streamed) {
+      setTypingText("");
+      return;
+    }
     if (messages.length > 0 && messages[messages.length - 1].sender === "bot") {
       const botMessages = Array.isArray(messages[messages.length - 1].text)
         ? messages[messages.length - 1].text
@@ -1,36 +1,58 @@
-import { useState } from "react";
- 
+import { useRef, useState } from "react";
+import { streamChat } from "../services/chatStream";
+
 type MessageType = {
   text: string;
   sender: "user" | "bot";
+  streamed?: boolean;
 };
- 
+
 export function useChat() {
   const [messages, setMessages] = useState<MessageType[]>([]);
   const [loading, setLoading] = useState(false);
- 
-  // Enviar mensaje del usuario
+  // Sesión devuelta por el backend; se reenvía para que memoria y cliente (tenant) sigan la conversación
+  const sessionIdRef = useRef<string | null>(null);
+
+  // Reemplaza el último mensaje del bot (el que se está transmitiendo)
+  const updateStreamedMessage = (update: (text: string) => string) => {
+    setMessages((prev) => {
+      const last = prev[prev.length - 1];
+      if (!last || !last.streamed) return prev;
+      return [...prev.slice(0, -1), { ...last, text: update(last.text) }];
+    });
+  };
+
+  // Enviar mensaje del usuario; la respuesta se pinta token a token vía SSE
   const sendMessage = async (text: string) => {
     setMessages((prev) => [...prev, { text, sender: "user" }]);
     setLoading(true);
+    let started = false;
+    const startBotMessage = () => {
+      if (started) return;
+      started = true;
+      setLoading(false);
+      setMessages((prev) => [...prev, { text: "", sender: "bot", streamed: true }]);
+    };
     try {
-      const res = await fetch("http://127.0.0.1:8000/chat/openai", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ message: text }),
-      });
-      const data = await res.json();
-      if (data.response) {
-        setMessages((prev) => [
-          ...prev,
-          { text: data.response, sender: "bot" },
-        ]);
-      } else {
-        setMessages((prev) => [
-          ...prev,
-          { text: "Error: respuesta vacía de la IA.", sender: "bot" },
-        ]);
-      }
+      await streamChat(
+        "http://127.0.0.1:8000/chat/openai/stream",
+        sessionIdRef.current ? { message: text, session_id: sessionIdRef.current } : { message: text },
+        {
+          onToken: (token) => {
+            startBotMessage();
+            updateStreamedMessage((prev) => prev + token);
+          },
+          onDone: (data) => {
+            if (data.session_id) sessionIdRef.current = data.session_id;
+            startBotMessage();
+            updateStreamedMessage(() => data.response || "Error: respuesta vacía de la IA.");
+          },
+          onError: (detail) => {
+            startBotMessage();
+            updateStreamedMessage((prev) => `${prev}\n\nError al consultar la IA: ${detail}`);
+          },
+        }
+      );
     } catch (error: any) {
       setMessages((prev) => [
         ...prev,
@@ -39,15 +61,14 @@ export function useChat() {
     }
     setLoading(false);
   };
- 
+
   // Agregar mensaje del bot desde el componente (para archivos)
   const pushBotMessage = (text: string, sender: "bot" | "user" = "bot") => {
     setMessages((prev) => [...prev, { text, sender }]);
   };
- 
+
   return { messages, sendMessage, loading, pushBotMessage, setMessages };
 }
- 
+
 export default useChat;
- 
- 
\ No newline at end of file
+
@@ -0,0 +1,58 @@
+export type ChatStreamDone = {
+  response: string;
+  format: string;
+  conversation_id: string;
+  session_id: string;
+};
+
+type ChatStreamHandlers = {
+  onToken: (token: string) => void;
+  onDone: (data: ChatStreamDone) => void;
+  onError: (detail: string) => void;
+};
+
+// Consume los eventos SSE (start, token, done, error) de /chat/<modelo>/stream
+export const streamChat = async (
+  url: string,
+  body: Record<string, unknown>,
+  handlers: ChatStreamHandlers
+) => {
+  const res = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json", Accept: "text/event-stream" },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok || !res.body) {
+    handlers.onError(`HTTP ${res.status}`);
+    return;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let separator;
+    while ((separator = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+
+      if (event === "token") handlers.onToken(payload.token);
+      else if (event === "done") handlers.onDone(payload);
+      else if (event === "error") handlers.onError(payload.detail);
+    }
+  }
+};